@@ -0,0 +1,166 @@
+"""
+Batched position encoding and evaluation on NumPy. encodePositions turns any number of GameStates (either backend) into
+one array of 12x8x8 piece planes plus a feature vector per position, and evaluateBatch scores the whole batch in a
+handful of array operations: material plus piece-square tables tapered by game phase (the same tables as
+ChessEvaluation, so scores agree with evaluate() less its pawn structure term when mobility is off) and a mobility
+term.
+
+Positions are gathered as twelve 64 bit piece bitboards each, so the only Python work per position is reading its
+piece lists; everything per square happens inside NumPy.
+
+Usage:
+    planes, features = ChessBatchEval.encodePositions(states)
+    scores = ChessBatchEval.evaluateBatch(states)
+    scores = ChessBatchEval.evaluateMoves(gs) # one score per legal move, from the mover's point of view
+"""
+import numpy as np
+
+import ChessBitboard
+import ChessEvaluation
+
+PIECES = ChessBitboard.PIECES # plane order: white P N B R Q K, then black
+PLANE_INDEX = {piece: i for i, piece in enumerate(PIECES)}
+FEATURE_NAMES = ("whiteToMove", "wks", "wqs", "bks", "bqs") + tuple("ep" + "abcdefgh"[c] for c in range(8))
+
+MG_WEIGHTS = np.array([ChessEvaluation.MG_TABLE[piece] for piece in PIECES], dtype=np.int32)
+EG_WEIGHTS = np.array([ChessEvaluation.EG_TABLE[piece] for piece in PIECES], dtype=np.int32)
+PHASE_VECTOR = np.array([ChessEvaluation.PHASE_WEIGHTS[piece[1]] for piece in PIECES], dtype=np.int32)
+
+# centipawns per square a piece attacks that is not taken by its own side
+MOBILITY_WEIGHTS = {"N": 4, "B": 5, "R": 2, "Q": 1}
+KNIGHT_STEPS = ((2, -1), (2, 1), (-2, 1), (-2, -1), (1, 2), (-1, 2), (1, -2), (-1, -2))
+ROOK_STEPS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+BISHOP_STEPS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+
+
+"""
+The twelve piece bitboards of a position in PIECES order, bit r*8+c set for a piece on (r,c)
+"""
+def positionBitboards(gs):
+    pieces = getattr(gs, "pieces", None)
+    if pieces is not None: # bitboard backend
+        return pieces
+    bitboards = [0] * 12
+    for piece, squares in gs.pieceSquares.items():
+        bitboard = 0
+        for r, c in squares:
+            bitboard |= 1 << (r * 8 + c)
+        bitboards[PLANE_INDEX[piece]] = bitboard
+    return bitboards
+
+
+def positionFeatures(gs):
+    rights = gs.currentCastlingRight
+    features = [int(gs.whiteToMove), int(rights.wks), int(rights.wqs), int(rights.bks), int(rights.bqs)] + [0] * 8
+    if gs.enpassantPossible != ():
+        features[5 + gs.enpassantPossible[1]] = 1
+    return features
+
+
+"""
+Builds the arrays from per position bitboards and features: planes is uint8 of shape (N, 12, 8, 8) and features is
+uint8 of shape (N, 13), laid out as FEATURE_NAMES
+"""
+def encodeBitboards(bitboards, features):
+    count = len(features)
+    raw = b"".join(bitboard.to_bytes(8, "little") for position in bitboards for bitboard in position)
+    planes = np.unpackbits(np.frombuffer(raw, dtype=np.uint8).reshape(count, 12, 8), axis=2, bitorder="little")
+    return planes.reshape(count, 12, 8, 8), np.array(features, dtype=np.uint8).reshape(count, len(FEATURE_NAMES))
+
+
+def encodePositions(states):
+    states = list(states)
+    return encodeBitboards([positionBitboards(gs) for gs in states], [positionFeatures(gs) for gs in states])
+
+
+"""
+Encodes the position after each of moves (default: every legal move) by making and undoing it on gs
+"""
+def encodeMoves(gs, moves=None):
+    if moves is None:
+        moves = gs.getValidMoves()
+    bitboards = []
+    features = []
+    for move in moves:
+        gs.makeMove(move)
+        bitboards.append(list(positionBitboards(gs)))
+        features.append(positionFeatures(gs))
+        gs.undoMove()
+    return encodeBitboards(bitboards, features)
+
+
+def shift(planes, dr, dc):
+    # moves every set square of (..., 8, 8) boolean planes by (dr, dc), dropping what falls off the board
+    shifted = np.zeros_like(planes)
+    rows = slice(max(dr, 0), 8 + min(dr, 0))
+    cols = slice(max(dc, 0), 8 + min(dc, 0))
+    fromRows = slice(max(-dr, 0), 8 + min(-dr, 0))
+    fromCols = slice(max(-dc, 0), 8 + min(-dc, 0))
+    shifted[..., rows, cols] = planes[..., fromRows, fromCols]
+    return shifted
+
+
+def stepMobility(pieces, own, steps):
+    count = np.zeros(pieces.shape[0], dtype=np.int32)
+    for dr, dc in steps:
+        count += (shift(pieces, dr, dc) & ~own).sum(axis=(1, 2), dtype=np.int32)
+    return count
+
+
+def slideMobility(pieces, own, empty, steps):
+    # every piece walks its rays one step at a time for the whole batch, stopping at the first occupied square
+    count = np.zeros(pieces.shape[0], dtype=np.int32)
+    for dr, dc in steps:
+        ray = pieces
+        for distance in range(7):
+            ray = shift(ray, dr, dc)
+            if not ray.any():
+                break
+            count += (ray & ~own).sum(axis=(1, 2), dtype=np.int32)
+            ray = ray & empty
+    return count
+
+
+"""
+Mobility term for white minus black, per position, from the boolean planes
+"""
+def mobility(planes):
+    white = planes[:, :6].any(axis=1)
+    black = planes[:, 6:].any(axis=1)
+    empty = ~(white | black)
+    score = np.zeros(planes.shape[0], dtype=np.int32)
+    for offset, own, sign in ((0, white, 1), (6, black, -1)):
+        score += sign * MOBILITY_WEIGHTS["N"] * stepMobility(planes[:, offset + 1], own, KNIGHT_STEPS)
+        score += sign * MOBILITY_WEIGHTS["B"] * slideMobility(planes[:, offset + 2], own, empty, BISHOP_STEPS)
+        score += sign * MOBILITY_WEIGHTS["R"] * slideMobility(planes[:, offset + 3], own, empty, ROOK_STEPS)
+        queens = planes[:, offset + 4]
+        score += sign * MOBILITY_WEIGHTS["Q"] * (slideMobility(queens, own, empty, ROOK_STEPS) +
+                                                 slideMobility(queens, own, empty, BISHOP_STEPS))
+    return score
+
+
+"""
+Scores encoded positions in centipawns from the point of view of the side to move, as int32 of shape (N,)
+"""
+def evaluatePlanes(planes, features, withMobility=True):
+    counts = planes.astype(np.int32)
+    mg = np.einsum("npij,pij->n", counts, MG_WEIGHTS)
+    eg = np.einsum("npij,pij->n", counts, EG_WEIGHTS)
+    phase = np.minimum(counts.sum(axis=(2, 3)) @ PHASE_VECTOR, ChessEvaluation.MAX_PHASE)
+    score = (mg * phase + eg * (ChessEvaluation.MAX_PHASE - phase)) // ChessEvaluation.MAX_PHASE
+    if withMobility:
+        score += mobility(planes.astype(bool))
+    return np.where(features[:, 0] == 1, score, -score)
+
+
+def evaluateBatch(states, withMobility=True):
+    planes, features = encodePositions(states)
+    return evaluatePlanes(planes, features, withMobility)
+
+
+"""
+Score of every candidate move for the side making it (higher is better for the mover), in the order of moves
+"""
+def evaluateMoves(gs, moves=None, withMobility=True):
+    planes, features = encodeMoves(gs, moves)
+    return -evaluatePlanes(planes, features, withMobility)
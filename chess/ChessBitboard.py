@@ -0,0 +1,610 @@
+"""
+Bitboard backed alternative to ChessEngine.GameState. The position is stored as one 64-bit integer per piece type and
+color (bit r*8+c is set when that square is occupied) plus a 64 entry mailbox for fast "what is on this square" lookups.
+Knight, king and pawn attacks come from precomputed tables and sliding attacks are looked up from precomputed rays cut
+at the first blocker. The public API (makeMove, undoMove, getValidMoves, board, inCheck, ...) matches GameState so the
+two backends can be swapped in ChessMain.
+"""
+from array import array
+
+import ChessEvaluation
+from ChessEngine import CastleRights, GameState, Move, parseFen, STARTING_FEN, ZOBRIST_PIECES, ZOBRIST_BLACK_TO_MOVE, ZOBRIST_CASTLING, ZOBRIST_ENPASSANT
+
+WHITE = 0
+BLACK = 1
+PIECES = ["wP", "wN", "wB", "wR", "wQ", "wK", "bP", "bN", "bB", "bR", "bQ", "bK"]
+PIECE_CODES = {piece: i for i, piece in enumerate(PIECES)}
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+EMPTY = -1
+FULL = (1 << 64) - 1
+
+# packed moves use Move's encoding: flags in bits 12..14, the promotion piece type (KNIGHT..QUEEN) in bits 15..17
+FLAG_ENPASSANT = Move.FLAG_ENPASSANT
+FLAG_CASTLING = Move.FLAG_CASTLING
+FLAG_PROMOTION = Move.FLAG_PROMOTION
+MAX_PLY = 128
+
+# castling right bits
+WKS, WQS, BKS, BQS = 1, 2, 4, 8
+
+
+def _onBoard(r, c):
+    return 0 <= r < 8 and 0 <= c < 8
+
+
+def _stepTable(offsets):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        bb = 0
+        for dr, dc in offsets:
+            if _onBoard(r + dr, c + dc):
+                bb |= 1 << ((r + dr) * 8 + c + dc)
+        table.append(bb)
+    return table
+
+
+KNIGHT_ATTACKS = _stepTable([(2, -1), (2, 1), (-2, 1), (-2, -1), (1, 2), (-1, 2), (1, -2), (-1, -2)])
+KING_ATTACKS = _stepTable([(-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1)])
+# squares attacked by a pawn of the given color standing on sq
+PAWN_ATTACKS = [_stepTable([(-1, -1), (-1, 1)]), _stepTable([(1, -1), (1, 1)])]
+
+# ray directions, the first four move towards lower square indices, the last four towards higher ones
+DIRECTIONS = [(-1, 0), (0, -1), (-1, -1), (-1, 1), (1, 0), (0, 1), (1, 1), (1, -1)]
+ROOK_DIRECTIONS = (0, 1, 4, 5)
+BISHOP_DIRECTIONS = (2, 3, 6, 7)
+RAYS = []
+for _dr, _dc in DIRECTIONS:
+    _table = []
+    for _sq in range(64):
+        _r, _c = divmod(_sq, 8)
+        _bb = 0
+        for _i in range(1, 8):
+            if not _onBoard(_r + _dr * _i, _c + _dc * _i):
+                break
+            _bb |= 1 << ((_r + _dr * _i) * 8 + _c + _dc * _i)
+        _table.append(_bb)
+    RAYS.append(_table)
+
+# BETWEEN[a][b] holds the squares strictly between a and b when they share a line, LINE[a][b] the whole line through both
+BETWEEN = [[0] * 64 for _ in range(64)]
+LINE = [[0] * 64 for _ in range(64)]
+for _a in range(64):
+    for _d in range(8):
+        _ray = RAYS[_d][_a]
+        _opposite = RAYS[(_d + 4) % 8][_a]
+        _bb = _ray
+        while _bb:
+            _bit = _bb & -_bb
+            _b = _bit.bit_length() - 1
+            BETWEEN[_a][_b] = _ray ^ RAYS[_d][_b] ^ _bit
+            LINE[_a][_b] = _ray | _opposite | (1 << _a)
+            _bb ^= _bit
+
+# castling rights that survive a move touching the square (king or rook leaving, rook being captured)
+CASTLE_MASK = [WKS | WQS | BKS | BQS] * 64
+CASTLE_MASK[60] &= ~(WKS | WQS)
+CASTLE_MASK[63] &= ~WKS
+CASTLE_MASK[56] &= ~WQS
+CASTLE_MASK[4] &= ~(BKS | BQS)
+CASTLE_MASK[7] &= ~BKS
+CASTLE_MASK[0] &= ~BQS
+
+# GameState's zobrist keys re-indexed by piece code and square, castling bits already match CastleRights.index()
+ZOBRIST_SQUARES = [[ZOBRIST_PIECES[piece][sq // 8][sq % 8] for sq in range(64)] for piece in PIECES]
+# evaluation tables re-indexed the same way, and the pawn only zobrist keys (zero for other pieces)
+MG_SQUARES = [[ChessEvaluation.MG_TABLE[piece][sq // 8][sq % 8] for sq in range(64)] for piece in PIECES]
+EG_SQUARES = [[ChessEvaluation.EG_TABLE[piece][sq // 8][sq % 8] for sq in range(64)] for piece in PIECES]
+PHASE_BY_CODE = [ChessEvaluation.PHASE_WEIGHTS[piece[1]] for piece in PIECES]
+PAWN_ZOBRIST = [ZOBRIST_SQUARES[code] if code % 6 == PAWN else [0] * 64 for code in range(12)]
+
+
+def slidingAttacks(sq, occupied, directions):
+    attacks = 0
+    for d in directions:
+        ray = RAYS[d][sq]
+        blockers = ray & occupied
+        if blockers:
+            if d < 4:  # towards lower indices, nearest blocker is the highest bit
+                blocker = blockers.bit_length() - 1
+            else:
+                blocker = (blockers & -blockers).bit_length() - 1
+            ray ^= RAYS[d][blocker]
+        attacks |= ray
+    return attacks
+
+
+def rookAttacks(sq, occupied):
+    return slidingAttacks(sq, occupied, ROOK_DIRECTIONS)
+
+
+def bishopAttacks(sq, occupied):
+    return slidingAttacks(sq, occupied, BISHOP_DIRECTIONS)
+
+
+def packMove(start, end, flags=0):
+    return start | (end << 6) | (flags << 12)
+
+
+"""
+One preallocated array of packed moves per ply, handed out again every time the search comes back to that ply so move
+lists cost 4 bytes per move and no new list objects in deep searches and perft.
+"""
+class MoveBufferStack():
+    def __init__(self, maxPly=MAX_PLY):
+        self.buffers = [array("I") for i in range(maxPly)]
+
+    def get(self, ply):
+        buffer = self.buffers[ply]
+        del buffer[:]
+        return buffer
+
+
+class BitboardGameState():
+    def __init__(self, fen=STARTING_FEN):
+        self.moveCache = None # optional TranspositionTable caching legal moves by zobristKey, see getValidPackedMoves
+        self.loadFen(fen)
+
+    def loadFen(self, fen):
+        board, self.whiteToMove, rights, enpassant, self.startHalfmoveClock, self.startFullmoveNumber = parseFen(fen)
+        self.pieces = [0] * 12
+        self.occupancy = [0, 0]
+        self.squares = [EMPTY] * 64
+        for r in range(8):
+            for c in range(8):
+                if board[r][c] != "--":
+                    self.putPiece(PIECE_CODES[board[r][c]], r * 8 + c)
+        self.movelog = []
+        self.undoStack = []
+        self.checkMate = False
+        self.staleMate = False
+        self.castling = rights.index()
+        self.castlingLog = [self.castling]
+        self.epSquare = enpassant[0] * 8 + enpassant[1] if enpassant else EMPTY
+        self.boardView = None
+        self.zobristKey = self.computeZobristKey()
+        self.halfmoveClockLog = [self.startHalfmoveClock]
+        self.positionCounts = {self.zobristKey: 1}
+        self.mgScore, self.egScore, self.phase, self.pawnKey = self.computeEvaluation()
+
+    # FEN output only reads board, whiteToMove, currentCastlingRight, enpassantPossible, halfmoveClockLog and movelog
+    getFen = GameState.getFen
+    # position history works on zobristKey, halfmoveClockLog and positionCounts alone
+    recordPosition = GameState.recordPosition
+    forgetPosition = GameState.forgetPosition
+    repetitionCount = GameState.repetitionCount
+    isThreefoldRepetition = GameState.isThreefoldRepetition
+    isFiftyMoveDraw = GameState.isFiftyMoveDraw
+    drawReason = GameState.drawReason
+    # reads board only, makePackedMove keeps the result up to date
+    computeEvaluation = GameState.computeEvaluation
+
+    def computeZobristKey(self):
+        key = 0
+        for sq in range(64):
+            if self.squares[sq] != EMPTY:
+                key ^= ZOBRIST_SQUARES[self.squares[sq]][sq]
+        if not self.whiteToMove:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_CASTLING[self.castling]
+        if self.epSquare != EMPTY:
+            key ^= ZOBRIST_ENPASSANT[self.epSquare & 7]
+        return key
+
+    def putPiece(self, piece, sq):
+        bit = 1 << sq
+        self.pieces[piece] |= bit
+        self.occupancy[piece // 6] |= bit
+        self.squares[sq] = piece
+        self.boardView = None
+
+    """
+    8x8 list of strings view used by ChessMain and Move, only rebuilt after the position changed
+    """
+    @property
+    def board(self):
+        if self.boardView is None:
+            names = [PIECES[piece] if piece != EMPTY else "--" for piece in self.squares]
+            self.boardView = [names[r * 8:r * 8 + 8] for r in range(8)]
+        return self.boardView
+
+    @property
+    def whiteKingLocation(self):
+        return divmod(self.pieces[5].bit_length() - 1, 8)
+
+    @property
+    def blackKingLocation(self):
+        return divmod(self.pieces[11].bit_length() - 1, 8)
+
+    @property
+    def enpassantPossible(self):
+        return divmod(self.epSquare, 8) if self.epSquare != EMPTY else ()
+
+    @property
+    def currentCastlingRight(self):
+        return self.castleRights(self.castling)
+
+    @property
+    def castleRightsLog(self):
+        return [self.castleRights(rights) for rights in self.castlingLog]
+
+    @staticmethod
+    def castleRights(rights):
+        return CastleRights(bool(rights & WKS), bool(rights & BKS), bool(rights & WQS), bool(rights & BQS))
+
+    def makeMove(self, move):
+        self.makePackedMove(move.pack())
+        self.movelog.append(move)
+
+    def undoMove(self):
+        if self.movelog:
+            self.movelog.pop()
+            self.undoPackedMove()
+
+    """
+    Plays a packed move (start | end << 6 | flags << 12 | promotion type << 15) without touching movelog, used by getValidMoves callers that
+    want to stay on integers such as perft.
+    """
+    def makePackedMove(self, packed):
+        start = packed & 63
+        end = (packed >> 6) & 63
+        flags = packed >> 12
+        pieces = self.pieces
+        occupancy = self.occupancy
+        squares = self.squares
+        piece = squares[start]
+        color = piece // 6
+        startBit = 1 << start
+        endBit = 1 << end
+
+        key = self.zobristKey ^ ZOBRIST_BLACK_TO_MOVE
+        mg = self.mgScore
+        eg = self.egScore
+        phase = self.phase
+        pawnKey = self.pawnKey
+
+        captured = squares[end]
+        capturedSq = end
+        if flags & FLAG_ENPASSANT:
+            capturedSq = end + 8 if color == WHITE else end - 8
+            captured = squares[capturedSq]
+        if captured != EMPTY:
+            capturedBit = 1 << capturedSq
+            pieces[captured] ^= capturedBit
+            occupancy[1 - color] ^= capturedBit
+            squares[capturedSq] = EMPTY
+            key ^= ZOBRIST_SQUARES[captured][capturedSq]
+            mg -= MG_SQUARES[captured][capturedSq]
+            eg -= EG_SQUARES[captured][capturedSq]
+            phase -= PHASE_BY_CODE[captured]
+            pawnKey ^= PAWN_ZOBRIST[captured][capturedSq]
+
+        pieces[piece] ^= startBit
+        placed = piece + (flags >> 3) if flags & FLAG_PROMOTION else piece
+        pieces[placed] |= endBit
+        occupancy[color] ^= startBit | endBit
+        squares[start] = EMPTY
+        squares[end] = placed
+        key ^= ZOBRIST_SQUARES[piece][start] ^ ZOBRIST_SQUARES[placed][end]
+        mg += MG_SQUARES[placed][end] - MG_SQUARES[piece][start]
+        eg += EG_SQUARES[placed][end] - EG_SQUARES[piece][start]
+        phase += PHASE_BY_CODE[placed] - PHASE_BY_CODE[piece]
+        pawnKey ^= PAWN_ZOBRIST[piece][start] ^ PAWN_ZOBRIST[placed][end]
+
+        if flags & FLAG_CASTLING:
+            if end > start:  # King side castling
+                rookFrom, rookTo = end + 1, end - 1
+            else:  # Queen side castling
+                rookFrom, rookTo = end - 2, end + 1
+            rook = piece - KING + ROOK
+            rookBits = (1 << rookFrom) | (1 << rookTo)
+            pieces[rook] ^= rookBits
+            occupancy[color] ^= rookBits
+            squares[rookFrom] = EMPTY
+            squares[rookTo] = rook
+            key ^= ZOBRIST_SQUARES[rook][rookFrom] ^ ZOBRIST_SQUARES[rook][rookTo]
+            mg += MG_SQUARES[rook][rookTo] - MG_SQUARES[rook][rookFrom]
+            eg += EG_SQUARES[rook][rookTo] - EG_SQUARES[rook][rookFrom]
+
+        self.undoStack.append((packed, piece, captured, capturedSq, self.castling, self.epSquare, self.zobristKey,
+                               self.mgScore, self.egScore, self.phase, self.pawnKey))
+        self.mgScore = mg
+        self.egScore = eg
+        self.phase = phase
+        self.pawnKey = pawnKey
+        if self.epSquare != EMPTY:
+            key ^= ZOBRIST_ENPASSANT[self.epSquare & 7]
+        if piece % 6 == PAWN and abs(end - start) == 16:
+            self.epSquare = (start + end) // 2
+            key ^= ZOBRIST_ENPASSANT[self.epSquare & 7]
+        else:
+            self.epSquare = EMPTY
+        key ^= ZOBRIST_CASTLING[self.castling]
+        self.castling &= CASTLE_MASK[start] & CASTLE_MASK[end]
+        key ^= ZOBRIST_CASTLING[self.castling]
+        self.castlingLog.append(self.castling)
+        self.zobristKey = key
+        self.whiteToMove = not self.whiteToMove
+        self.boardView = None
+        self.recordPosition(captured != EMPTY or piece % 6 == PAWN)
+
+    def undoPackedMove(self):
+        self.forgetPosition()
+        (packed, piece, captured, capturedSq, self.castling, self.epSquare, self.zobristKey,
+         self.mgScore, self.egScore, self.phase, self.pawnKey) = self.undoStack.pop()
+        start = packed & 63
+        end = (packed >> 6) & 63
+        flags = packed >> 12
+        pieces = self.pieces
+        occupancy = self.occupancy
+        squares = self.squares
+        color = piece // 6
+        startBit = 1 << start
+        endBit = 1 << end
+
+        pieces[squares[end]] ^= endBit
+        pieces[piece] |= startBit
+        occupancy[color] ^= startBit | endBit
+        squares[end] = EMPTY
+        squares[start] = piece
+        if captured != EMPTY:
+            capturedBit = 1 << capturedSq
+            pieces[captured] |= capturedBit
+            occupancy[1 - color] |= capturedBit
+            squares[capturedSq] = captured
+
+        if flags & FLAG_CASTLING:
+            if end > start:
+                rookFrom, rookTo = end + 1, end - 1
+            else:
+                rookFrom, rookTo = end - 2, end + 1
+            rook = piece - KING + ROOK
+            rookBits = (1 << rookFrom) | (1 << rookTo)
+            pieces[rook] ^= rookBits
+            occupancy[color] ^= rookBits
+            squares[rookTo] = EMPTY
+            squares[rookFrom] = rook
+
+        self.castlingLog.pop()
+        self.whiteToMove = not self.whiteToMove
+        self.boardView = None
+
+    """
+    Bitboard of the squares holding pieces of byColor that attack sq, with occupied as the blocking pieces
+    """
+    def attackersBitboard(self, sq, byColor, occupied=None):
+        if occupied is None:
+            occupied = self.occupancy[0] | self.occupancy[1]
+        pieces = self.pieces
+        base = byColor * 6
+        queens = pieces[base + QUEEN]
+        return ((PAWN_ATTACKS[1 - byColor][sq] & pieces[base + PAWN])
+                | (KNIGHT_ATTACKS[sq] & pieces[base + KNIGHT])
+                | (KING_ATTACKS[sq] & pieces[base + KING])
+                | (rookAttacks(sq, occupied) & (pieces[base + ROOK] | queens))
+                | (bishopAttacks(sq, occupied) & (pieces[base + BISHOP] | queens)))
+
+    def squareAttacked(self, sq, byColor, occupied=None):
+        if occupied is None:
+            occupied = self.occupancy[0] | self.occupancy[1]
+        pieces = self.pieces
+        base = byColor * 6
+        if PAWN_ATTACKS[1 - byColor][sq] & pieces[base + PAWN]:
+            return True
+        if KNIGHT_ATTACKS[sq] & pieces[base + KNIGHT]:
+            return True
+        if KING_ATTACKS[sq] & pieces[base + KING]:
+            return True
+        queens = pieces[base + QUEEN]
+        if rookAttacks(sq, occupied) & (pieces[base + ROOK] | queens):
+            return True
+        return bool(bishopAttacks(sq, occupied) & (pieces[base + BISHOP] | queens))
+
+    """
+    Row/col versions matching GameState, byColor is "w" or "b"
+    """
+    def isSquareAttacked(self, r, c, byColor):
+        return self.squareAttacked(r * 8 + c, WHITE if byColor == "w" else BLACK)
+
+    def attackersOf(self, r, c, byColor):
+        attackers = []
+        bb = self.attackersBitboard(r * 8 + c, WHITE if byColor == "w" else BLACK)
+        while bb:
+            bit = bb & -bb
+            bb ^= bit
+            attackers.append(divmod(bit.bit_length() - 1, 8))
+        return attackers
+
+    def inCheck(self):
+        us = WHITE if self.whiteToMove else BLACK
+        return self.squareAttacked(self.pieces[us * 6 + KING].bit_length() - 1, 1 - us)
+
+    def squareInCheck(self, r, c):
+        return self.squareAttacked(r * 8 + c, BLACK if self.whiteToMove else WHITE)
+
+    """
+    All moves considering checks, as Move objects for ChessMain
+    """
+    def getValidMoves(self):
+        packedMoves = self.getValidPackedMoves()
+        board = self.board
+        return [Move.fromPacked(packed, board) for packed in packedMoves]
+
+    """
+    Legal moves as packed integers appended to moves (or a new list). With moveCache set, a position seen before is
+    served from the table, which holds the packed moves in an array plus whether the side to move is in check.
+    """
+    def getValidPackedMoves(self, moves=None):
+        if moves is None:
+            moves = []
+        if self.moveCache is None:
+            return self.generateValidPackedMoves(moves)
+        cached = self.moveCache.probe(self.zobristKey)
+        if cached is not None:
+            packedMoves, inCheck = cached
+            moves.extend(packedMoves)
+            self.updateGameOver(packedMoves, inCheck)
+            return moves
+        start = len(moves)
+        self.generateValidPackedMoves(moves)
+        self.moveCache.store(self.zobristKey, (array("I", moves[start:]), self.inCheck()))
+        return moves
+
+    """
+    Legal move generation: checkers and pinned pieces are found once, then every piece only generates moves that resolve
+    the check and stay on its pin ray, so no move ever has to be played to test its legality. Moves are appended to
+    the given buffer (e.g. one from MoveBufferStack, so search and perft reuse the same arrays ply after ply) or to a
+    new list.
+    """
+    def generateValidPackedMoves(self, moves):
+        pieces = self.pieces
+        us = WHITE if self.whiteToMove else BLACK
+        them = 1 - us
+        base = us * 6
+        enemyBase = them * 6
+        own = self.occupancy[us]
+        enemy = self.occupancy[them]
+        occupied = own | enemy
+        kingSq = pieces[base + KING].bit_length() - 1
+        kingBit = 1 << kingSq
+        enemyQueens = pieces[enemyBase + QUEEN]
+        enemyStraight = pieces[enemyBase + ROOK] | enemyQueens
+        enemyDiagonal = pieces[enemyBase + BISHOP] | enemyQueens
+
+        checkers = self.attackersBitboard(kingSq, them, occupied)
+
+        # king moves, with the king lifted off the board so it can't hide behind itself on a slider's ray
+        withoutKing = occupied ^ kingBit
+        targets = KING_ATTACKS[kingSq] & ~own
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            end = bit.bit_length() - 1
+            if not self.squareAttacked(end, them, withoutKing):
+                moves.append(kingSq | (end << 6))
+
+        if checkers & (checkers - 1):  # double check, only the king can move
+            self.updateGameOver(moves, checkers)
+            return moves
+
+        if checkers:
+            checker = checkers.bit_length() - 1
+            evasion = checkers | BETWEEN[kingSq][checker]
+        else:
+            evasion = FULL
+            self.getCastleMoves(kingSq, occupied, us, moves)
+
+        # pinned pieces may only move along the line between the king and the pinner
+        pinned = 0
+        pinRays = {}
+        snipers = ((rookAttacks(kingSq, enemy) & enemyStraight) | (bishopAttacks(kingSq, enemy) & enemyDiagonal))
+        while snipers:
+            bit = snipers & -snipers
+            snipers ^= bit
+            sniper = bit.bit_length() - 1
+            blockers = BETWEEN[kingSq][sniper] & occupied
+            if blockers and not (blockers & (blockers - 1)) and blockers & own:
+                pinned |= blockers
+                pinRays[blockers.bit_length() - 1] = LINE[kingSq][sniper]
+
+        target = ~own & evasion
+
+        bb = pieces[base + KNIGHT] & ~pinned
+        while bb:
+            bit = bb & -bb
+            bb ^= bit
+            start = bit.bit_length() - 1
+            self.addMoves(start, KNIGHT_ATTACKS[start] & target, moves)
+
+        for piece, directions in ((BISHOP, BISHOP_DIRECTIONS), (ROOK, ROOK_DIRECTIONS), (QUEEN, None)):
+            bb = pieces[base + piece]
+            while bb:
+                bit = bb & -bb
+                bb ^= bit
+                start = bit.bit_length() - 1
+                if directions is None:
+                    attacks = rookAttacks(start, occupied) | bishopAttacks(start, occupied)
+                else:
+                    attacks = slidingAttacks(start, occupied, directions)
+                attacks &= target
+                if bit & pinned:
+                    attacks &= pinRays[start]
+                self.addMoves(start, attacks, moves)
+
+        self.getPawnMoves(us, occupied, enemy, evasion, pinned, pinRays, kingSq, moves)
+        self.updateGameOver(moves, checkers)
+        return moves
+
+    def addMoves(self, start, targets, moves):
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            moves.append(start | ((bit.bit_length() - 1) << 6))
+
+    def getPawnMoves(self, us, occupied, enemy, evasion, pinned, pinRays, kingSq, moves):
+        pieces = self.pieces
+        step = -8 if us == WHITE else 8
+        startRow = 6 if us == WHITE else 1
+        lastRow = 0 if us == WHITE else 7
+        bb = pieces[us * 6 + PAWN]
+        while bb:
+            bit = bb & -bb
+            bb ^= bit
+            start = bit.bit_length() - 1
+            allowed = evasion & pinRays[start] if bit & pinned else evasion
+            targets = PAWN_ATTACKS[us][start] & enemy
+            one = start + step
+            if not (occupied >> one) & 1:
+                targets |= 1 << one
+                two = one + step
+                if start >> 3 == startRow and not (occupied >> two) & 1:
+                    targets |= 1 << two
+            targets &= allowed
+            while targets:
+                endBit = targets & -targets
+                targets ^= endBit
+                end = endBit.bit_length() - 1
+                if end >> 3 == lastRow:
+                    for promotion in (QUEEN, ROOK, BISHOP, KNIGHT):
+                        moves.append(start | (end << 6) | ((FLAG_PROMOTION | promotion << 3) << 12))
+                else:
+                    moves.append(start | (end << 6))
+            if self.epSquare != EMPTY and PAWN_ATTACKS[us][start] >> self.epSquare & 1:
+                if self.enpassantIsLegal(start, self.epSquare, us, occupied, kingSq):
+                    moves.append(start | (self.epSquare << 6) | (FLAG_ENPASSANT << 12))
+
+    """
+    En passant removes two pieces from the capturer's rank, so it is checked by replaying it on the occupancy: this
+    covers pins, discovered checks along the rank and capturing a checking pawn in one go.
+    """
+    def enpassantIsLegal(self, start, end, us, occupied, kingSq):
+        them = 1 - us
+        capturedSq = end + 8 if us == WHITE else end - 8
+        occupied = occupied ^ (1 << start) ^ (1 << end) ^ (1 << capturedSq)
+        pieces = self.pieces
+        enemyBase = them * 6
+        queens = pieces[enemyBase + QUEEN]
+        if rookAttacks(kingSq, occupied) & (pieces[enemyBase + ROOK] | queens):
+            return False
+        if bishopAttacks(kingSq, occupied) & (pieces[enemyBase + BISHOP] | queens):
+            return False
+        if KNIGHT_ATTACKS[kingSq] & pieces[enemyBase + KNIGHT]:
+            return False
+        return not PAWN_ATTACKS[us][kingSq] & pieces[enemyBase + PAWN] & ~(1 << capturedSq)
+
+    def getCastleMoves(self, kingSq, occupied, us, moves):
+        them = 1 - us
+        if us == WHITE:
+            kingSide, queenSide = self.castling & WKS, self.castling & WQS
+        else:
+            kingSide, queenSide = self.castling & BKS, self.castling & BQS
+        if kingSide and not occupied & ((1 << (kingSq + 1)) | (1 << (kingSq + 2))):
+            if not self.squareAttacked(kingSq + 1, them, occupied) and not self.squareAttacked(kingSq + 2, them, occupied):
+                moves.append(kingSq | ((kingSq + 2) << 6) | (FLAG_CASTLING << 12))
+        if queenSide and not occupied & ((1 << (kingSq - 1)) | (1 << (kingSq - 2)) | (1 << (kingSq - 3))):
+            if not self.squareAttacked(kingSq - 1, them, occupied) and not self.squareAttacked(kingSq - 2, them, occupied):
+                moves.append(kingSq | ((kingSq - 2) << 6) | (FLAG_CASTLING << 12))
+
+    def updateGameOver(self, moves, checkers):
+        self.checkMate = not moves and bool(checkers)
+        self.staleMate = not moves and not checkers
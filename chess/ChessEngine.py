@@ -1,9 +1,93 @@
+import random
+import re
+from array import array
+
+import ChessEvaluation
+
+# offsets used when looking outward from a square for attackers
+ROOK_DIRECTIONS = ((-1,0),(0,-1),(1,0),(0,1))
+BISHOP_DIRECTIONS = ((-1,-1),(-1,1),(1,-1),(1,1))
+KNIGHT_JUMPS = ((-2,-1),(-2,1),(-1,-2),(-1,2),(1,-2),(1,2),(2,-1),(2,1))
+KING_STEPS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+# piece names of each color in the order pawn, knight, bishop, rock, queen, king
+COLOR_PIECES = {"w": ("wP","wN","wB","wR","wQ","wK"), "b": ("bP","bN","bB","bR","bQ","bK")}
+
+# Zobrist keys, seeded so every process (and both GameState backends) hash positions the same way
+_zobristRandom = random.Random(20211)
+ZOBRIST_PIECES = {piece: [[_zobristRandom.getrandbits(64) for c in range(8)] for r in range(8)]
+                  for piece in COLOR_PIECES["w"] + COLOR_PIECES["b"]}
+ZOBRIST_BLACK_TO_MOVE = _zobristRandom.getrandbits(64)
+ZOBRIST_CASTLING = [_zobristRandom.getrandbits(64) for i in range(16)] # indexed by CastleRights.index()
+ZOBRIST_ENPASSANT = [_zobristRandom.getrandbits(64) for c in range(8)] # indexed by the enpassant column
+
+STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+"""
+Splits a FEN string into an 8x8 board of piece names, whiteToMove, CastleRights, the enpassant square as () or
+(row, col), the halfmove clock and the fullmove number. Raises ValueError for malformed input.
+"""
+def parseFen(fen):
+    fields = fen.split()
+    if len(fields) < 4:
+        raise ValueError("FEN needs at least 4 fields: " + fen)
+    rows = fields[0].split("/")
+    if len(rows) != 8:
+        raise ValueError("FEN board needs 8 rows: " + fen)
+    board = []
+    for row in rows:
+        boardRow = []
+        for ch in row:
+            if ch.isdigit():
+                boardRow.extend(["--"] * int(ch))
+            elif ch.upper() in "PNBRQK":
+                boardRow.append(("w" if ch.isupper() else "b") + ch.upper())
+            else:
+                raise ValueError("Bad piece " + ch + " in FEN: " + fen)
+        if len(boardRow) != 8:
+            raise ValueError("FEN row needs 8 squares: " + row)
+        board.append(boardRow)
+    for king in ("wK", "bK"):
+        if sum(boardRow.count(king) for boardRow in board) != 1:
+            raise ValueError("FEN needs exactly one " + king + ": " + fen)
+    if fields[1] not in ("w", "b"):
+        raise ValueError("Bad side to move in FEN: " + fen)
+    castling = fields[2]
+    # a right only survives while its king and rock are still on their home squares
+    whiteKing = board[7][4] == "wK"
+    blackKing = board[0][4] == "bK"
+    castleRights = CastleRights("K" in castling and whiteKing and board[7][7] == "wR",
+                                "k" in castling and blackKing and board[0][7] == "bR",
+                                "Q" in castling and whiteKing and board[7][0] == "wR",
+                                "q" in castling and blackKing and board[0][0] == "bR")
+    enpassant = ()
+    if fields[3] != "-":
+        # only the square a pawn just skipped can be an enpassant target
+        if len(fields[3]) != 2 or fields[3][0] not in Move.filesToCols or fields[3][1] != ("6" if fields[1] == "w" else "3"):
+            raise ValueError("Bad enpassant square in FEN: " + fen)
+        row, col = Move.ranksToRows[fields[3][1]], Move.filesToCols[fields[3][0]]
+        pawnRow, fromRow, pawn = (row + 1, row - 1, "bP") if fields[1] == "w" else (row - 1, row + 1, "wP")
+        if board[pawnRow][col] != pawn or board[row][col] != "--" or board[fromRow][col] != "--":
+            raise ValueError("No pawn just passed the enpassant square in FEN: " + fen)
+        enpassant = (row, col)
+    halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+    fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+    return board, fields[1] == "w", castleRights, enpassant, halfmoveClock, fullmoveNumber
+
+"""
+The legal move of gs written as coordinate notation (e2e4, e7e8n), works with any GameState backend
+"""
+def moveFromNotation(gs, notation):
+    for move in gs.getValidMoves():
+        if move.getChessNotation() == notation:
+            return move
+    raise ValueError("Illegal move " + notation)
+
 """
 This class is responsible for storing all the info about the current state of a chess game. It will also be responsible
 for determining the valid moves at the current state. It will also keep a move log.
 """
 class GameState():
-    def __init__(self):
+    def __init__(self,fen=None):
         # Here we have 8x8 grid,1st letter tells about color "black" or "white" and 2nd tells about type.
         self.board = [
             ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
@@ -16,7 +100,8 @@ class GameState():
             ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]
         ]
 
-        self.moveFunction = {"P":self.getPawnMoves,"R":self.getRockMoves,"N":self.getKnightMoves,"B":self.getBishopMoves,"K":self.getKingMoves,"Q":self.getQueenMoves}
+        # generator names, looked up on every call so methods swapped on the class (ChessInstrument) reach live instances
+        self.moveFunction = {"P":"getPawnMoves","R":"getRockMoves","N":"getKnightMoves","B":"getBishopMoves","K":"getKingMoves","Q":"getQueenMoves"}
         self.whiteToMove = True
         self.movelog = []
         self.whiteKingLocation = (7,4)
@@ -26,7 +111,119 @@ class GameState():
         self.enpassantPossible = ()
         self.currentCastlingRight = CastleRights(True,True,True,True)
         self.castleRightsLog = [CastleRights(self.currentCastlingRight.wks,self.currentCastlingRight.bks,self.currentCastlingRight.wqs,self.currentCastlingRight.bqs)]
+        self.enpassantPossibleLog = [self.enpassantPossible]
+        self.pins = {}
+        self.checks = []
+        self.pieceSquares = self.computePieceSquares()
+        self.zobristKey = self.computeZobristKey()
+        self.zobristLog = [self.zobristKey]
+        self.moveCache = None # optional TranspositionTable caching getValidMoves by zobristKey
+        self.startHalfmoveClock = 0 # FEN counters of the position the move log starts from
+        self.startFullmoveNumber = 1
+        self.halfmoveClockLog = [self.startHalfmoveClock]
+        self.positionCounts = {self.zobristKey: 1}
+        self.mgScore, self.egScore, self.phase, self.pawnKey = self.computeEvaluation()
+        self.evaluationLog = [(self.mgScore, self.egScore, self.phase, self.pawnKey)]
+        if fen is not None:
+            self.loadFen(fen)
+
+    """
+    Sets up the position described by a FEN string, clearing the move log
+    """
+    def loadFen(self,fen):
+        self.board, self.whiteToMove, self.currentCastlingRight, self.enpassantPossible, self.startHalfmoveClock, self.startFullmoveNumber = parseFen(fen)
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c] == "wK":
+                    self.whiteKingLocation = (r,c)
+                elif self.board[r][c] == "bK":
+                    self.blackKingLocation = (r,c)
+        self.movelog = []
+        self.checkMate = False
+        self.staleMate = False
+        self.castleRightsLog = [CastleRights(self.currentCastlingRight.wks,self.currentCastlingRight.bks,self.currentCastlingRight.wqs,self.currentCastlingRight.bqs)]
+        self.enpassantPossibleLog = [self.enpassantPossible]
+        self.pieceSquares = self.computePieceSquares()
+        self.zobristKey = self.computeZobristKey()
+        self.zobristLog = [self.zobristKey]
+        self.halfmoveClockLog = [self.startHalfmoveClock]
+        self.positionCounts = {self.zobristKey: 1}
+        self.mgScore, self.egScore, self.phase, self.pawnKey = self.computeEvaluation()
+        self.evaluationLog = [(self.mgScore, self.egScore, self.phase, self.pawnKey)]
+
+    """
+    FEN string of the current position
+    """
+    def getFen(self):
+        rows = []
+        for row in self.board:
+            fenRow = ""
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                else:
+                    if empty:
+                        fenRow += str(empty)
+                        empty = 0
+                    fenRow += piece[1] if piece[0] == "w" else piece[1].lower()
+            if empty:
+                fenRow += str(empty)
+            rows.append(fenRow)
+        rights = self.currentCastlingRight
+        castling = ("K" if rights.wks else "") + ("Q" if rights.wqs else "") + ("k" if rights.bks else "") + ("q" if rights.bqs else "")
+        enpassant = Move.colsToFiles[self.enpassantPossible[1]] + Move.rowsToRanks[self.enpassantPossible[0]] if self.enpassantPossible else "-"
+        startedWithBlack = self.whiteToMove == (len(self.movelog) % 2 == 1)
+        fullmoveNumber = self.startFullmoveNumber + (len(self.movelog) + startedWithBlack) // 2
+        return "%s %s %s %s %d %d" % ("/".join(rows), "w" if self.whiteToMove else "b", castling or "-", enpassant, self.halfmoveClockLog[-1], fullmoveNumber)
 
+    """
+    Piece lists: the set of (row, col) squares holding each piece name, kept in step with the board by makeMove and
+    undoMove so move generation and evaluation only visit squares that actually have pieces on them
+    """
+    def computePieceSquares(self):
+        pieceSquares = {piece: set() for piece in COLOR_PIECES["w"] + COLOR_PIECES["b"]}
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c] != "--":
+                    pieceSquares[self.board[r][c]].add((r,c))
+        return pieceSquares
+
+    """
+    Hash of the whole position from scratch, makeMove keeps zobristKey equal to this incrementally
+    """
+    def computeZobristKey(self):
+        key = 0
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c] != "--":
+                    key ^= ZOBRIST_PIECES[self.board[r][c]][r][c]
+        if not self.whiteToMove:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_CASTLING[self.currentCastlingRight.index()]
+        if self.enpassantPossible:
+            key ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
+        return key
+
+    """
+    Evaluation state from scratch: middlegame and endgame material plus piece-square score (white minus black), the
+    game phase and a zobrist key of the pawns alone. makeMove keeps these up to date incrementally.
+    """
+    def computeEvaluation(self):
+        mg = 0
+        eg = 0
+        phase = 0
+        pawnKey = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    mg += ChessEvaluation.MG_TABLE[piece][r][c]
+                    eg += ChessEvaluation.EG_TABLE[piece][r][c]
+                    phase += ChessEvaluation.PHASE_WEIGHTS[piece[1]]
+                    if piece[1] == "P":
+                        pawnKey ^= ZOBRIST_PIECES[piece][r][c]
+        return mg, eg, phase, pawnKey
 
     def makeMove(self,move):
         self.board[move.startRow][move.startCol] = "--"
@@ -39,7 +236,7 @@ class GameState():
             self.blackKingLocation = (move.endRow, move.endCol)
         # Pawn Promotion
         if move.isPawnPromotion:
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0]+"Q"
+            self.board[move.endRow][move.endCol] = move.pieceMoved[0]+move.promotionChoice
         # enpassant move
         if move.isEnPassantMove:
              self.board[move.startRow][move.endCol] = "--"  # capturing the pawn
@@ -49,6 +246,7 @@ class GameState():
             self.enpassantPossible = ((move.startRow + move.endRow) // 2, move.startCol)
         else:
             self.enpassantPossible = ()
+        self.enpassantPossibleLog.append(self.enpassantPossible)
 
         # castle move
         if move.isCastling:
@@ -62,6 +260,157 @@ class GameState():
         #update castling rights whenever it is rock or king move
         self.updateCastleRights(move)
         self.castleRightsLog.append(CastleRights(self.currentCastlingRight.wks,self.currentCastlingRight.bks,self.currentCastlingRight.wqs,self.currentCastlingRight.bqs))
+        self.updatePieceSquares(move)
+        self.updateZobristKey(move)
+        self.updateEvaluation(move)
+        self.recordPosition(move.pieceMoved[1] == "P" or move.pieceCaptured != "--")
+
+    """
+    Moves the piece list entries for a move already played on the board: the moved piece (or its promotion), the
+    captured piece (on the passed square for enpassant) and the rock of a castle
+    """
+    def updatePieceSquares(self,move):
+        pieceSquares = self.pieceSquares
+        pieceSquares[move.pieceMoved].remove((move.startRow,move.startCol))
+        if move.isEnPassantMove:
+            pieceSquares[move.pieceCaptured].remove((move.startRow,move.endCol))
+        elif move.pieceCaptured != "--":
+            pieceSquares[move.pieceCaptured].remove((move.endRow,move.endCol))
+        pieceSquares[self.board[move.endRow][move.endCol]].add((move.endRow,move.endCol))
+        if move.isCastling:
+            rock = pieceSquares[move.pieceMoved[0]+"R"]
+            if move.endCol - move.startCol == 2:
+                rock.remove((move.endRow,move.endCol+1))
+                rock.add((move.endRow,move.endCol-1))
+            else:
+                rock.remove((move.endRow,move.endCol-2))
+                rock.add((move.endRow,move.endCol+1))
+
+    def restorePieceSquares(self,move):
+        pieceSquares = self.pieceSquares
+        placed = move.pieceMoved[0]+move.promotionChoice if move.isPawnPromotion else move.pieceMoved
+        pieceSquares[placed].remove((move.endRow,move.endCol))
+        pieceSquares[move.pieceMoved].add((move.startRow,move.startCol))
+        if move.isEnPassantMove:
+            pieceSquares[move.pieceCaptured].add((move.startRow,move.endCol))
+        elif move.pieceCaptured != "--":
+            pieceSquares[move.pieceCaptured].add((move.endRow,move.endCol))
+        if move.isCastling:
+            rock = pieceSquares[move.pieceMoved[0]+"R"]
+            if move.endCol - move.startCol == 2:
+                rock.remove((move.endRow,move.endCol-1))
+                rock.add((move.endRow,move.endCol+1))
+            else:
+                rock.remove((move.endRow,move.endCol+1))
+                rock.add((move.endRow,move.endCol-2))
+
+    """
+    Xors the changes of the move just played into zobristKey: moved, captured and promoted pieces, the rock hop of a
+    castle, the side to move and the castling/enpassant state before and after.
+    """
+    def updateZobristKey(self,move):
+        key = self.zobristKey ^ ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_PIECES[move.pieceMoved][move.startRow][move.startCol]
+        key ^= ZOBRIST_PIECES[self.board[move.endRow][move.endCol]][move.endRow][move.endCol]
+        if move.isEnPassantMove:
+            key ^= ZOBRIST_PIECES[move.pieceCaptured][move.startRow][move.endCol]
+        elif move.pieceCaptured != "--":
+            key ^= ZOBRIST_PIECES[move.pieceCaptured][move.endRow][move.endCol]
+        if move.isCastling:
+            rock = move.pieceMoved[0] + "R"
+            if move.endCol - move.startCol == 2:
+                key ^= ZOBRIST_PIECES[rock][move.endRow][move.endCol+1] ^ ZOBRIST_PIECES[rock][move.endRow][move.endCol-1]
+            else:
+                key ^= ZOBRIST_PIECES[rock][move.endRow][move.endCol-2] ^ ZOBRIST_PIECES[rock][move.endRow][move.endCol+1]
+        key ^= ZOBRIST_CASTLING[self.castleRightsLog[-2].index()] ^ ZOBRIST_CASTLING[self.castleRightsLog[-1].index()]
+        previousEnpassant = self.enpassantPossibleLog[-2]
+        if previousEnpassant:
+            key ^= ZOBRIST_ENPASSANT[previousEnpassant[1]]
+        if self.enpassantPossible:
+            key ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
+        self.zobristKey = key
+        self.zobristLog.append(key)
+
+    """
+    Applies a move just played on the board to the evaluation state: the moved piece (or its promotion), the captured
+    piece (on the passed square for enpassant) and the rock hop of a castle
+    """
+    def updateEvaluation(self,move):
+        mgTable = ChessEvaluation.MG_TABLE
+        egTable = ChessEvaluation.EG_TABLE
+        placed = self.board[move.endRow][move.endCol]
+        mg = self.mgScore - mgTable[move.pieceMoved][move.startRow][move.startCol] + mgTable[placed][move.endRow][move.endCol]
+        eg = self.egScore - egTable[move.pieceMoved][move.startRow][move.startCol] + egTable[placed][move.endRow][move.endCol]
+        phase = self.phase
+        pawnKey = self.pawnKey
+        if move.pieceMoved[1] == "P":
+            pawnKey ^= ZOBRIST_PIECES[move.pieceMoved][move.startRow][move.startCol]
+            if move.isPawnPromotion:
+                phase += ChessEvaluation.PHASE_WEIGHTS[move.promotionChoice]
+            else:
+                pawnKey ^= ZOBRIST_PIECES[move.pieceMoved][move.endRow][move.endCol]
+        if move.pieceCaptured != "--":
+            captureRow = move.startRow if move.isEnPassantMove else move.endRow
+            mg -= mgTable[move.pieceCaptured][captureRow][move.endCol]
+            eg -= egTable[move.pieceCaptured][captureRow][move.endCol]
+            phase -= ChessEvaluation.PHASE_WEIGHTS[move.pieceCaptured[1]]
+            if move.pieceCaptured[1] == "P":
+                pawnKey ^= ZOBRIST_PIECES[move.pieceCaptured][captureRow][move.endCol]
+        if move.isCastling:
+            rock = move.pieceMoved[0] + "R"
+            if move.endCol - move.startCol == 2:
+                rockFrom, rockTo = move.endCol + 1, move.endCol - 1
+            else:
+                rockFrom, rockTo = move.endCol - 2, move.endCol + 1
+            mg += mgTable[rock][move.endRow][rockTo] - mgTable[rock][move.endRow][rockFrom]
+            eg += egTable[rock][move.endRow][rockTo] - egTable[rock][move.endRow][rockFrom]
+        self.mgScore = mg
+        self.egScore = eg
+        self.phase = phase
+        self.pawnKey = pawnKey
+        self.evaluationLog.append((mg, eg, phase, pawnKey))
+
+    """
+    Position history: the halfmove clock after every ply and how often each zobrist key has occurred in the game, so
+    repetitions and the fifty move rule are answered in constant time. Called by makeMove once zobristKey is updated.
+    Positions right after a double pawn push carry the enpassant file in their key, so they only repeat each other.
+    """
+    def recordPosition(self,irreversible):
+        self.halfmoveClockLog.append(0 if irreversible else self.halfmoveClockLog[-1] + 1)
+        self.positionCounts[self.zobristKey] = self.positionCounts.get(self.zobristKey, 0) + 1
+
+    # undoMove counterpart of recordPosition, called before zobristKey is rolled back
+    def forgetPosition(self):
+        self.halfmoveClockLog.pop()
+        count = self.positionCounts[self.zobristKey] - 1
+        if count:
+            self.positionCounts[self.zobristKey] = count
+        else:
+            del self.positionCounts[self.zobristKey]
+
+    def repetitionCount(self):
+        return self.positionCounts.get(self.zobristKey, 0)
+
+    def isThreefoldRepetition(self):
+        return self.positionCounts.get(self.zobristKey, 0) >= 3
+
+    def isFiftyMoveDraw(self):
+        return self.halfmoveClockLog[-1] >= 100
+
+    """
+    Why the game is drawn ("stalemate", "threefold repetition", "fifty-move rule") or None. staleMate is only set by
+    getValidMoves, and a checkmate on the hundredth halfmove still wins.
+    """
+    def drawReason(self):
+        if self.staleMate:
+            return "stalemate"
+        if self.checkMate:
+            return None
+        if self.isThreefoldRepetition():
+            return "threefold repetition"
+        if self.isFiftyMoveDraw():
+            return "fifty-move rule"
+        return None
 
     def undoMove(self):
         if self.movelog:
@@ -77,14 +426,13 @@ class GameState():
             if move.isEnPassantMove:
                 self.board[move.endRow][move.endCol] = "--"
                 self.board[move.startRow][move.endCol] = move.pieceCaptured
-                self.enpassantPossible = (move.endRow,move.endCol)
+            self.enpassantPossibleLog.pop()
+            self.enpassantPossible = self.enpassantPossibleLog[-1]
 
-            if move.pieceMoved[1] == "P" and abs(move.startRow - move.endRow) == 2:
-                self.enpassantPossible = ()
-
-            # undo castling rights
+            # undo castling rights, copy it so the log entry is not changed by the next updateCastleRights
             self.castleRightsLog.pop()
-            self.currentCastlingRight = self.castleRightsLog[-1]
+            rights = self.castleRightsLog[-1]
+            self.currentCastlingRight = CastleRights(rights.wks,rights.bks,rights.wqs,rights.bqs)
 
             # undo castle move
             if move.isCastling:
@@ -94,6 +442,14 @@ class GameState():
                 else:  # Queen side castling
                     self.board[move.endRow][move.endCol + 1] = "--"
                     self.board[move.endRow][move.endCol - 2] = move.pieceMoved[0] + "R"
+            self.restorePieceSquares(move)
+            self.forgetPosition()
+            self.evaluationLog.pop()
+            self.mgScore, self.egScore, self.phase, self.pawnKey = self.evaluationLog[-1]
+            self.zobristLog.pop()
+            self.zobristKey = self.zobristLog[-1]
+            self.checkMate = False
+            self.staleMate = False
 
     def updateCastleRights(self,move):
         if move.pieceMoved == "wK":
@@ -114,35 +470,68 @@ class GameState():
                     self.currentCastlingRight.bqs = False
                 elif move.startCol == 7: #right rock
                     self.currentCastlingRight.bks = False
+        # a captured rock can't castle anymore either
+        if move.pieceCaptured == "wR":
+            if move.endRow == 7:
+                if move.endCol == 0:
+                    self.currentCastlingRight.wqs = False
+                elif move.endCol == 7:
+                    self.currentCastlingRight.wks = False
+        elif move.pieceCaptured == "bR":
+            if move.endRow == 0:
+                if move.endCol == 0:
+                    self.currentCastlingRight.bqs = False
+                elif move.endCol == 7:
+                    self.currentCastlingRight.bks = False
 
     """
-    All moves considering checks
+    All moves considering checks. Pins and checks are found once by looking outward from the king, pinned pieces only
+    move along their pin and in check only the moves that capture or block the checker are kept, so no move has to be
+    played to see whether it leaves the king in check.
     """
     def getValidMoves(self):
-        # print(len(self.castleRightsLog))
-        tempEnpassantPossible = self.enpassantPossible
-        tempCastleRights = CastleRights(self.currentCastlingRight.wks,self.currentCastlingRight.bks,self.currentCastlingRight.wqs,self.currentCastlingRight.bqs)
-        print("In:",tempCastleRights.wqs)
-        moves = self.getAllPossibleMoves()
+        if self.moveCache is not None:
+            cached = self.moveCache.probe(self.zobristKey)
+            if cached is not None:
+                packedMoves, inCheck = cached
+                self.checkMate = len(packedMoves) == 0 and inCheck
+                self.staleMate = len(packedMoves) == 0 and not inCheck
+                return [Move.fromPacked(packed, self.board) for packed in packedMoves]
+        self.pins, self.checks = self.checkForPinsAndChecks()
         if self.whiteToMove:
-            self.getCastleMoves(self.whiteKingLocation[0],self.whiteKingLocation[1],moves)
+            kingRow, kingCol = self.whiteKingLocation
         else:
-            self.getCastleMoves(self.blackKingLocation[0],self.blackKingLocation[1],moves)
-        for i in range(len(moves)-1,-1,-1):
-            self.makeMove(moves[i])
-            self.whiteToMove = not self.whiteToMove
-            if self.inCheck():
+            kingRow, kingCol = self.blackKingLocation
+        if len(self.checks) == 1:
+            moves = self.getAllPossibleMoves()
+            checkRow, checkCol, dr, dc = self.checks[0]
+            if self.board[checkRow][checkCol][1] == "N": # a knight check can only be captured
+                validSquares = {(checkRow, checkCol)}
+            else: # squares between the king and the checker, including the checker itself
+                validSquares = set()
+                for i in range(1, 8):
+                    validSquares.add((kingRow + dr*i, kingCol + dc*i))
+                    if (kingRow + dr*i, kingCol + dc*i) == (checkRow, checkCol):
+                        break
+            for i in range(len(moves)-1,-1,-1):
+                move = moves[i]
+                if move.pieceMoved[1] == "K":
+                    continue
+                if (move.endRow, move.endCol) in validSquares:
+                    continue
+                if move.isEnPassantMove and (move.startRow, move.endCol) == (checkRow, checkCol):
+                    continue
                 moves.pop(i)
-            self.whiteToMove = not self.whiteToMove
-            self.undoMove()
-        if len(moves) == 0:
-            if self.inCheck():
-                self.checkMate = True
-            else:
-                self.staleMate = True
-        self.enpassantPossible = tempEnpassantPossible
-        self.currentCastlingRight = tempCastleRights
-        print("Out:",self.currentCastlingRight.wqs)
+        elif self.checks: # double check, king has to move
+            moves = []
+            self.getKingMoves(kingRow, kingCol, moves)
+        else:
+            moves = self.getAllPossibleMoves()
+            self.getCastleMoves(kingRow, kingCol, moves)
+        self.checkMate = len(moves) == 0 and len(self.checks) > 0
+        self.staleMate = len(moves) == 0 and len(self.checks) == 0
+        if self.moveCache is not None:
+            self.moveCache.store(self.zobristKey, (array("I", [move.pack() for move in moves]), len(self.checks) > 0))
         return moves
 
     def inCheck(self):
@@ -152,63 +541,205 @@ class GameState():
             return self.squareInCheck(self.blackKingLocation[0],self.blackKingLocation[1])
 
     def squareInCheck(self,r,c):
-        self.whiteToMove = not self.whiteToMove
-        oppMoves = self.getAllPossibleMoves()
-        self.whiteToMove = not self.whiteToMove
-        for move in oppMoves:
-            if move.endRow == r and move.endCol == c:
+        return self.isSquareAttacked(r,c,"b" if self.whiteToMove else "w")
+
+    """
+    True if any piece of byColor attacks (r, c). Probes outward from the square along the rock/bishop lines and the
+    pawn offsets, and checks the few knights and the king from the piece lists, so nothing is allocated and the side to
+    move doesn't matter. Lines are skipped entirely when byColor has no piece that moves along them.
+    """
+    def isSquareAttacked(self,r,c,byColor):
+        board = self.board
+        pieceSquares = self.pieceSquares
+        pawn, knight, bishop, rock, queen, king = COLOR_PIECES[byColor]
+        pawnRow = r+1 if byColor=="w" else r-1 # white pawns attack upwards, so they stand one row below
+        if pieceSquares[pawn] and 0<=pawnRow<8:
+            if c>0 and board[pawnRow][c-1]==pawn:
+                return True
+            if c<7 and board[pawnRow][c+1]==pawn:
                 return True
+        for knightRow,knightCol in pieceSquares[knight]: # usually 0-2 knights, cheaper than probing 8 jumps
+            if (r-knightRow)*(r-knightRow) + (c-knightCol)*(c-knightCol) == 5:
+                if board[knightRow][knightCol]==knight:
+                    return True
+        kingRow,kingCol = self.whiteKingLocation if byColor=="w" else self.blackKingLocation
+        if abs(r-kingRow)<=1 and abs(c-kingCol)<=1 and (r,c)!=(kingRow,kingCol):
+            return True
+        hasQueen = len(pieceSquares[queen]) > 0
+        if hasQueen or pieceSquares[rock]:
+            for dr,dc in ROOK_DIRECTIONS:
+                endRow = r+dr
+                endCol = c+dc
+                while 0<=endRow<8 and 0<=endCol<8:
+                    piece = board[endRow][endCol]
+                    if piece!="--":
+                        if piece==rock or piece==queen:
+                            return True
+                        break
+                    endRow += dr
+                    endCol += dc
+        if hasQueen or pieceSquares[bishop]:
+            for dr,dc in BISHOP_DIRECTIONS:
+                endRow = r+dr
+                endCol = c+dc
+                while 0<=endRow<8 and 0<=endCol<8:
+                    piece = board[endRow][endCol]
+                    if piece!="--":
+                        if piece==bishop or piece==queen:
+                            return True
+                        break
+                    endRow += dr
+                    endCol += dc
         return False
 
+    """
+    Same probe as isSquareAttacked but returns the (row, col) of every piece of byColor attacking (r, c)
+    """
+    def attackersOf(self,r,c,byColor):
+        board = self.board
+        pieceSquares = self.pieceSquares
+        pawn, knight, bishop, rock, queen, king = COLOR_PIECES[byColor]
+        attackers = []
+        pawnRow = r+1 if byColor=="w" else r-1
+        if pieceSquares[pawn] and 0<=pawnRow<8:
+            if c>0 and board[pawnRow][c-1]==pawn:
+                attackers.append((pawnRow,c-1))
+            if c<7 and board[pawnRow][c+1]==pawn:
+                attackers.append((pawnRow,c+1))
+        for knightRow,knightCol in pieceSquares[knight]:
+            if (r-knightRow)*(r-knightRow) + (c-knightCol)*(c-knightCol) == 5 and board[knightRow][knightCol]==knight:
+                attackers.append((knightRow,knightCol))
+        kingRow,kingCol = self.whiteKingLocation if byColor=="w" else self.blackKingLocation
+        if abs(r-kingRow)<=1 and abs(c-kingCol)<=1 and (r,c)!=(kingRow,kingCol):
+            attackers.append((kingRow,kingCol))
+        for directions, slider in ((ROOK_DIRECTIONS, rock), (BISHOP_DIRECTIONS, bishop)):
+            for dr,dc in directions:
+                endRow = r+dr
+                endCol = c+dc
+                while 0<=endRow<8 and 0<=endCol<8:
+                    piece = board[endRow][endCol]
+                    if piece!="--":
+                        if piece==slider or piece==queen:
+                            attackers.append((endRow,endCol))
+                        break
+                    endRow += dr
+                    endCol += dc
+        return attackers
+
+    """
+    Looks outward from the king of the side to move along all 8 lines and the knight jumps. Returns the pinned pieces
+    as {(row, col): direction from the king} and the checks as (row, col, dr, dc) of each checking piece.
+    """
+    def checkForPinsAndChecks(self):
+        pins = {}
+        checks = []
+        if self.whiteToMove:
+            enemyColor, allyColor = "b", "w"
+            r, c = self.whiteKingLocation
+        else:
+            enemyColor, allyColor = "w", "b"
+            r, c = self.blackKingLocation
+        directions = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+        for j in range(len(directions)):
+            d = directions[j]
+            possiblePin = ()
+            for i in range(1,8):
+                endRow = r + d[0]*i
+                endCol = c + d[1]*i
+                if 0<= endRow < 8 and 0<= endCol < 8:
+                    endPiece = self.board[endRow][endCol]
+                    if endPiece[0] == allyColor:
+                        if possiblePin == ():
+                            possiblePin = (endRow, endCol)
+                        else: # second ally piece, no pin or check in this direction
+                            break
+                    elif endPiece[0] == enemyColor:
+                        pieceType = endPiece[1]
+                        # orthogonal rock, diagonal bishop, adjacent pawn on its capture diagonal, queen, adjacent king
+                        if (0 <= j <= 3 and pieceType == "R") or (4 <= j <= 7 and pieceType == "B") or \
+                                (i == 1 and pieceType == "P" and ((enemyColor == "w" and 6 <= j <= 7) or (enemyColor == "b" and 4 <= j <= 5))) or \
+                                pieceType == "Q" or (i == 1 and pieceType == "K"):
+                            if possiblePin == ():
+                                checks.append((endRow, endCol, d[0], d[1]))
+                            else:
+                                pins[possiblePin] = d
+                        break
+                else:
+                    break
+        for m in KNIGHT_JUMPS:
+            endRow = r + m[0]
+            endCol = c + m[1]
+            if 0 <= endRow < 8 and 0 <= endCol < 8:
+                endPiece = self.board[endRow][endCol]
+                if endPiece[0] == enemyColor and endPiece[1] == "N":
+                    checks.append((endRow, endCol, m[0], m[1]))
+        return pins, checks
+
+    """
+    A pinned piece may only move along the line through its king and the pinner
+    """
+    def pinAllows(self,r,c,dr,dc):
+        pinDirection = self.pins.get((r,c))
+        return pinDirection is None or pinDirection == (dr,dc) or pinDirection == (-dr,-dc)
+
     """
     All possible moves of selected sq
     """
     def getAllPossibleMoves(self):
         moves = []
-        for r in range(8):
-            for c in range(8):
-                turn = self.board[r][c][0]
-                if (turn=="w" and self.whiteToMove) or (turn=="b" and not self.whiteToMove):
-                    piece = self.board[r][c][1]
-                    self.moveFunction[piece](r,c,moves)
+        for piece in COLOR_PIECES["w" if self.whiteToMove else "b"]:
+            moveFunction = getattr(self, self.moveFunction[piece[1]])
+            for r,c in self.pieceSquares[piece]:
+                moveFunction(r,c,moves)
         return moves
 
     def getPawnMoves(self,r,c,moves):
         if self.whiteToMove:#White chance to move
-            if self.board[r-1][c]=="--":
-                moves.append(Move((r,c),(r-1,c),self.board))
-                if r==6 and self.board[r-2][c]=="--":
-                    moves.append(Move((r, c), (r - 2, c), self.board))
-            if c>0 and self.board[r-1][c-1][0]=="b": #Enemy
-                moves.append(Move((r, c),(r-1,c-1), self.board))
-            elif c>0 and (r-1,c-1) == self.enpassantPossible:
-                # print(self.enpassantPossible,r,c,r-1,c-1)
-                moves.append(Move((r, c), (r - 1, c - 1), self.board,isEnPassantMove=True))
-            if c<7 and self.board[r-1][c+1][0]=="b": #Enemy
-                moves.append(Move((r, c),(r-1,c+1), self.board))
-            elif c<7 and (r-1,c+1) == self.enpassantPossible:
-                # print(self.enpassantPossible,r,c,r-1,c+1)
-                moves.append(Move((r, c), (r - 1, c + 1), self.board,isEnPassantMove=True))
+            moveAmount, startRow, enemyColor = -1, 6, "b"
         else: #Black move
-            if self.board[r+1][c]=="--":
-                moves.append(Move((r,c),(r+1,c),self.board))
-                if r==1 and self.board[r+2][c]=="--":
-                    moves.append(Move((r, c), (r + 2, c), self.board))
-            if c<7 and self.board[r+1][c+1][0]=="w": #Enemy
-                moves.append(Move((r, c),(r+1,c+1), self.board))
-            elif c<7 and (r+1,c+1) == self.enpassantPossible:
-                # print(self.enpassantPossible,r,c,r+1,c+1)
-                moves.append(Move((r, c), (r + 1, c + 1), self.board,isEnPassantMove=True))
-            if c>0 and self.board[r+1][c-1][0]=="w": #Enemy
-                moves.append(Move((r, c),(r+1,c-1), self.board))
-            elif c>0 and (r+1,c-1) == self.enpassantPossible:
-                # print(self.enpassantPossible,r,c,r+1,c-1)
-                moves.append(Move((r, c), (r + 1, c - 1), self.board,isEnPassantMove=True))
+            moveAmount, startRow, enemyColor = 1, 1, "w"
+        if self.board[r+moveAmount][c]=="--" and self.pinAllows(r,c,moveAmount,0):
+            self.addPawnMove((r,c),(r+moveAmount,c),moves)
+            if r==startRow and self.board[r+2*moveAmount][c]=="--":
+                moves.append(Move((r, c), (r + 2*moveAmount, c), self.board))
+        for dc in (-1,1):
+            endCol = c + dc
+            if 0<=endCol<8 and self.pinAllows(r,c,moveAmount,dc):
+                if self.board[r+moveAmount][endCol][0]==enemyColor: #Enemy
+                    self.addPawnMove((r,c),(r+moveAmount,endCol),moves)
+                elif (r+moveAmount,endCol) == self.enpassantPossible and self.enpassantIsLegal(r,c,endCol):
+                    moves.append(Move((r, c), (r + moveAmount, endCol), self.board,isEnPassantMove=True))
+
+    def addPawnMove(self,startSq,endSq,moves):
+        if endSq[0]==0 or endSq[0]==7: # one move per promotion piece
+            for piece in Move.promotionPieces:
+                moves.append(Move(startSq,endSq,self.board,promotionChoice=piece))
+        else:
+            moves.append(Move(startSq,endSq,self.board))
+
+    """
+    En passant takes two pawns off the same rank, which can expose the king along that rank even though neither pawn
+    is pinned on its own, so the capture is played on the board and the king checked directly.
+    """
+    def enpassantIsLegal(self,r,c,endCol):
+        pawn = self.board[r][c]
+        capturedPawn = self.board[r][endCol]
+        endRow = r-1 if self.whiteToMove else r+1
+        self.board[r][c] = "--"
+        self.board[r][endCol] = "--"
+        self.board[endRow][endCol] = pawn
+        legal = not self.inCheck()
+        self.board[endRow][endCol] = "--"
+        self.board[r][endCol] = capturedPawn
+        self.board[r][c] = pawn
+        return legal
 
     def getRockMoves(self,r,c,moves):
         directions = ((-1,0),(0,-1),(1,0),(0,1))
         enemyColor = "b" if self.whiteToMove else "w"
         for d in directions:
+            if not self.pinAllows(r,c,d[0],d[1]):
+                continue
             for i in range(1,8):
                 endRow = r + d[0]*i
                 endCol = c + d[1]*i
@@ -225,6 +756,8 @@ class GameState():
                     break
 
     def getKnightMoves(self,r,c,moves):
+        if (r,c) in self.pins: # a pinned knight can never stay on the pin line
+            return
         arr = [[r + 2, c - 1], [r + 2, c+1], [r - 2, c + 1], [r-2, c - 1], [r + 1, c + 2], [r - 1, c+2], [r + 1, c - 2],
                [r-1, c - 2]]
         for P in arr:
@@ -238,14 +771,17 @@ class GameState():
 
     def getKingMoves(self,r,c,moves):
         arr = [[r-1,c-1],[r-1,c],[r-1,c+1],[r,c+1],[r+1,c+1],[r+1,c],[r+1,c-1],[r,c-1]]
+        allyColor = "w" if self.whiteToMove else "b"
+        king = self.board[r][c]
+        self.board[r][c] = "--" # lift the king so it doesn't shield the squares behind it from sliding attacks
+        safeSquares = []
         for P in arr:
-            if 0<=P[0]<8 and 0<=P[1]<8:
-                if self.board[P[0]][P[1]]=="--":
-                    moves.append(Move((r, c), (P[0], P[1]), self.board))
-                elif self.whiteToMove and self.board[P[0]][P[1]][0]=="b":
-                    moves.append(Move((r, c), (P[0], P[1]), self.board))
-                elif not self.whiteToMove and self.board[P[0]][P[1]][0]=="w":
-                    moves.append(Move((r, c), (P[0], P[1]), self.board))
+            if 0<=P[0]<8 and 0<=P[1]<8 and self.board[P[0]][P[1]][0]!=allyColor:
+                if not self.squareInCheck(P[0],P[1]):
+                    safeSquares.append(P)
+        self.board[r][c] = king
+        for P in safeSquares:
+            moves.append(Move((r, c), (P[0], P[1]), self.board))
 
     def getCastleMoves(self,r,c,moves):
         if self.squareInCheck(r,c):
@@ -273,6 +809,8 @@ class GameState():
         directions = ((-1, -1), (1, -1), (-1, 1), (1, 1))
         enemyColor = "b" if self.whiteToMove else "w"
         for d in directions:
+            if not self.pinAllows(r,c,d[0],d[1]):
+                continue
             for i in range(1, 8):
                 endRow = r + d[0] * i
                 endCol = c + d[1] * i
@@ -297,9 +835,79 @@ class CastleRights():
         self.bks = bks
         self.bqs = bqs
 
+    """
+    The four rights packed into 0..15, used to index the castling zobrist keys
+    """
+    def index(self):
+        return self.wks | self.wqs << 1 | self.bks << 2 | self.bqs << 3
+
+
+# bytes per moveCache entry: the slot, key and tuple plus an array("I") of a typical 30-40 move list, with headroom
+MOVE_LIST_ENTRY_BYTES = 512
+
+
+"""
+Fixed size hash table keyed on GameState.zobristKey, used to cache legal move lists and search results. The number of
+slots is the largest power of two that fits sizeMB given an estimated entryBytes per entry, so memory stays bounded no
+matter how many positions are stored, as long as entryBytes matches what is stored. Search results are small, while a
+table set as gs.moveCache holds packed move arrays and should be built with entryBytes=MOVE_LIST_ENTRY_BYTES. A slot
+is replaced when it is empty, holds the same position, was written in an older search generation or holds a
+shallower (or equal) depth result.
+"""
+class TranspositionTable():
+    def __init__(self,sizeMB=16,entryBytes=256):
+        slots = max(1, (sizeMB * 1024 * 1024) // entryBytes)
+        self.size = 1 << (slots.bit_length() - 1)
+        self.mask = self.size - 1
+        self.keys = [0] * self.size
+        self.values = [None] * self.size
+        self.depths = [0] * self.size
+        self.generations = [0] * self.size
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def probe(self,key):
+        i = key & self.mask
+        if self.keys[i] == key and self.values[i] is not None:
+            self.hits += 1
+            return self.values[i]
+        self.misses += 1
+        return None
+
+    def store(self,key,value,depth=0):
+        i = key & self.mask
+        if self.values[i] is None or self.keys[i] == key or self.generations[i] != self.generation or depth >= self.depths[i]:
+            self.keys[i] = key
+            self.values[i] = value
+            self.depths[i] = depth
+            self.generations[i] = self.generation
+
+    """
+    Called at the start of each search so entries from earlier searches become the first to be replaced
+    """
+    def newSearch(self):
+        self.generation += 1
+
+    def clear(self):
+        self.keys = [0] * self.size
+        self.values = [None] * self.size
+        self.depths = [0] * self.size
+        self.generations = [0] * self.size
+        self.hits = 0
+        self.misses = 0
 
 
+
+"""
+Moves are small immutable records: __slots__ keeps each instance to a fixed set of fields with no per-object __dict__,
+and every move also has a packed integer form, start | end << 6 | flags << 12 | promotion type << 15 (squares are
+row*8+col), for storing moves in arrays and hash tables. moveId is the part of that encoding a player chooses (start,
+end and promotion piece), so it is what equality and hashing use.
+"""
 class Move():
+    __slots__ = ("startRow","startCol","endRow","endCol","pieceMoved","pieceCaptured","isPawnPromotion",
+                 "isEnPassantMove","isCastling","promotionChoice","moveId")
     # maps keys to values
     ranksToRows = {"1":7,"2":6,"3":5,"4":4,
                    "5":3,"6":2,"7":1,"8":0}
@@ -307,7 +915,15 @@ class Move():
     filesToCols = {"h": 7, "g": 6, "f": 5, "e": 4,
                    "d": 3, "c": 2, "b": 1, "a": 0}
     colsToFiles = {v:k for k,v in filesToCols.items()}
-    def __init__(self,startSq,endSq,board,isEnPassantMove=False,isCastling=False):
+    # queen first so a plain click in ChessMain (which builds a queen promotion) matches the same moveId
+    promotionPieces = ("Q","R","B","N")
+    # packed encoding flags (bits 12..14) and promotion piece types (bits 15..17)
+    FLAG_ENPASSANT = 1
+    FLAG_CASTLING = 2
+    FLAG_PROMOTION = 4
+    promotionTypes = {"N": 1, "B": 2, "R": 3, "Q": 4}
+    promotionNames = {v:k for k,v in promotionTypes.items()}
+    def __init__(self,startSq,endSq,board,isEnPassantMove=False,isCastling=False,promotionChoice="Q"):
         self.startRow = startSq[0]
         self.startCol = startSq[1]
         self.endRow = endSq[0]
@@ -319,7 +935,32 @@ class Move():
         if self.isEnPassantMove:
             self.pieceCaptured = "wP" if self.pieceMoved=="bP" else "bP"
         self.isCastling = isCastling
-        self.moveId = 1000*self.startRow + 100*self.startCol + 10*self.endRow + self.endCol
+        self.promotionChoice = promotionChoice
+        self.moveId = (self.startRow*8 + self.startCol) | (self.endRow*8 + self.endCol) << 6
+        if self.isPawnPromotion:
+            self.moveId |= self.promotionPieces.index(promotionChoice) << 12
+
+    """
+    Rebuilds the move from its packed form on the board it is played on
+    """
+    @classmethod
+    def fromPacked(cls,packed,board):
+        start = packed & 63
+        end = (packed >> 6) & 63
+        flags = (packed >> 12) & 7
+        return cls((start >> 3, start & 7),(end >> 3, end & 7),board,
+                   isEnPassantMove=bool(flags & cls.FLAG_ENPASSANT),isCastling=bool(flags & cls.FLAG_CASTLING),
+                   promotionChoice=cls.promotionNames[packed >> 15] if flags & cls.FLAG_PROMOTION else "Q")
+
+    def pack(self):
+        packed = (self.startRow*8 + self.startCol) | (self.endRow*8 + self.endCol) << 6
+        if self.isEnPassantMove:
+            packed |= self.FLAG_ENPASSANT << 12
+        if self.isCastling:
+            packed |= self.FLAG_CASTLING << 12
+        if self.isPawnPromotion:
+            packed |= (self.FLAG_PROMOTION | self.promotionTypes[self.promotionChoice] << 3) << 12
+        return packed
 
     """
     overriding the equals while comparing moves in main fun
@@ -329,14 +970,99 @@ class Move():
             return self.moveId == other.moveId
         return False
 
+    def __hash__(self):
+        return self.moveId
 
     def getChessNotation(self):
         # real chess Notation
-        return self.getRankFile(self.startRow,self.startCol) + self.getRankFile(self.endRow,self.endCol)
+        notation = self.getRankFile(self.startRow,self.startCol) + self.getRankFile(self.endRow,self.endCol)
+        if self.isPawnPromotion:
+            notation += self.promotionChoice.lower()
+        return notation
 
     def getRankFile(self,r,c):
         return self.colsToFiles[c]+self.rowsToRanks[r]
 
+    """
+    Standard algebraic notation (Nbd7, exd6, e8=Q+, O-O#) of this move in gs, the position it is played from.
+    validMoves can be passed when the caller already has them. The check/mate suffix needs the move to be played,
+    withCheck=False skips that.
+    """
+    def getSan(self,gs,validMoves=None,withCheck=True):
+        if self.isCastling:
+            san = "O-O" if self.endCol > self.startCol else "O-O-O"
+        else:
+            pieceType = self.pieceMoved[1]
+            isCapture = self.pieceCaptured != "--"
+            if pieceType == "P":
+                san = self.colsToFiles[self.startCol] + "x" if isCapture else ""
+            else:
+                san = pieceType
+                if validMoves is None:
+                    validMoves = gs.getValidMoves()
+                sameFile = sameRank = ambiguous = False
+                for other in validMoves:
+                    if other.pieceMoved == self.pieceMoved and other.endRow == self.endRow and other.endCol == self.endCol \
+                            and (other.startRow, other.startCol) != (self.startRow, self.startCol):
+                        ambiguous = True
+                        sameFile = sameFile or other.startCol == self.startCol
+                        sameRank = sameRank or other.startRow == self.startRow
+                if ambiguous:
+                    if not sameFile:
+                        san += self.colsToFiles[self.startCol]
+                    elif not sameRank:
+                        san += self.rowsToRanks[self.startRow]
+                    else:
+                        san += self.getRankFile(self.startRow, self.startCol)
+                if isCapture:
+                    san += "x"
+            san += self.getRankFile(self.endRow, self.endCol)
+            if self.isPawnPromotion:
+                san += "=" + self.promotionChoice
+        if withCheck:
+            checkMate, staleMate = gs.checkMate, gs.staleMate
+            gs.makeMove(self)
+            if gs.inCheck():
+                san += "#" if not gs.getValidMoves() else "+"
+            gs.undoMove()
+            gs.checkMate, gs.staleMate = checkMate, staleMate
+        return san
 
+    sanPattern = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?-?([a-h][1-8])(?:=?([NBRQ]))?$")
 
-
+    """
+    The legal move of gs written in SAN. Accepts check marks, annotations (!?), 0-O castling and a missing "x" or
+    "=". Raises ValueError if the move is illegal or ambiguous.
+    """
+    @classmethod
+    def fromSan(cls,san,gs,validMoves=None):
+        text = san.rstrip("+#!?")
+        if validMoves is None:
+            validMoves = gs.getValidMoves()
+        if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+            kingSide = len(text) == 3
+            for move in validMoves:
+                if move.isCastling and (move.endCol > move.startCol) == kingSide:
+                    return move
+            raise ValueError("Illegal castling " + san)
+        match = cls.sanPattern.match(text)
+        if match is None:
+            raise ValueError("Bad SAN " + san)
+        pieceType, fromFile, fromRank, endSquare, promotion = match.groups()
+        pieceType = pieceType or "P"
+        endRow = cls.ranksToRows[endSquare[1]]
+        endCol = cls.filesToCols[endSquare[0]]
+        candidates = []
+        for move in validMoves:
+            if move.endRow != endRow or move.endCol != endCol or move.pieceMoved[1] != pieceType:
+                continue
+            if fromFile is not None and move.startCol != cls.filesToCols[fromFile]:
+                continue
+            if fromRank is not None and move.startRow != cls.ranksToRows[fromRank]:
+                continue
+            if move.isPawnPromotion and move.promotionChoice != (promotion or "Q"):
+                continue
+            candidates.append(move)
+        if len(candidates) != 1:
+            raise ValueError(("Ambiguous move " if candidates else "Illegal move ") + san)
+        return candidates[0]
@@ -0,0 +1,242 @@
+"""
+Static evaluation: material plus piece-square tables, tapered between middlegame and endgame values by the amount of
+non-pawn material left, and a pawn structure term (doubled, isolated and passed pawns). Scores are in centipawns.
+Tables are written from white's point of view with row 0 being the 8th rank, exactly like GameState.board, and
+mirrored for black.
+
+Both backends keep the material and piece-square sums, the phase and a zobrist key of the pawns up to date in
+makeMove/undoMove, and the pawn structure term is cached on that key, so evaluate() reads a position in O(1).
+"""
+
+PIECE_VALUES_MG = {"P": 82, "N": 337, "B": 365, "R": 477, "Q": 1025, "K": 0}
+PIECE_VALUES_EG = {"P": 94, "N": 281, "B": 297, "R": 512, "Q": 936, "K": 0}
+
+# how much each piece counts towards the game phase, MAX_PHASE is the full starting material
+PHASE_WEIGHTS = {"P": 0, "N": 1, "B": 1, "R": 2, "Q": 4, "K": 0}
+MAX_PHASE = 24
+
+PAWN_MG = [
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [50, 50, 50, 50, 50, 50, 50, 50],
+    [10, 10, 20, 30, 30, 20, 10, 10],
+    [5, 5, 10, 25, 25, 10, 5, 5],
+    [0, 0, 0, 20, 20, 0, 0, 0],
+    [5, -5, -10, 0, 0, -10, -5, 5],
+    [5, 10, 10, -20, -20, 10, 10, 5],
+    [0, 0, 0, 0, 0, 0, 0, 0]
+]
+PAWN_EG = [
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [80, 80, 80, 80, 80, 80, 80, 80],
+    [50, 50, 50, 50, 50, 50, 50, 50],
+    [30, 30, 30, 30, 30, 30, 30, 30],
+    [20, 20, 20, 20, 20, 20, 20, 20],
+    [10, 10, 10, 10, 10, 10, 10, 10],
+    [10, 10, 10, 10, 10, 10, 10, 10],
+    [0, 0, 0, 0, 0, 0, 0, 0]
+]
+KNIGHT = [
+    [-50, -40, -30, -30, -30, -30, -40, -50],
+    [-40, -20, 0, 0, 0, 0, -20, -40],
+    [-30, 0, 10, 15, 15, 10, 0, -30],
+    [-30, 5, 15, 20, 20, 15, 5, -30],
+    [-30, 0, 15, 20, 20, 15, 0, -30],
+    [-30, 5, 10, 15, 15, 10, 5, -30],
+    [-40, -20, 0, 5, 5, 0, -20, -40],
+    [-50, -40, -30, -30, -30, -30, -40, -50]
+]
+BISHOP = [
+    [-20, -10, -10, -10, -10, -10, -10, -20],
+    [-10, 0, 0, 0, 0, 0, 0, -10],
+    [-10, 0, 5, 10, 10, 5, 0, -10],
+    [-10, 5, 5, 10, 10, 5, 5, -10],
+    [-10, 0, 10, 10, 10, 10, 0, -10],
+    [-10, 10, 10, 10, 10, 10, 10, -10],
+    [-10, 5, 0, 0, 0, 0, 5, -10],
+    [-20, -10, -10, -10, -10, -10, -10, -20]
+]
+ROCK = [
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [5, 10, 10, 10, 10, 10, 10, 5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [0, 0, 0, 5, 5, 0, 0, 0]
+]
+QUEEN = [
+    [-20, -10, -10, -5, -5, -10, -10, -20],
+    [-10, 0, 0, 0, 0, 0, 0, -10],
+    [-10, 0, 5, 5, 5, 5, 0, -10],
+    [-5, 0, 5, 5, 5, 5, 0, -5],
+    [0, 0, 5, 5, 5, 5, 0, -5],
+    [-10, 5, 5, 5, 5, 5, 0, -10],
+    [-10, 0, 5, 0, 0, 0, 0, -10],
+    [-20, -10, -10, -5, -5, -10, -10, -20]
+]
+KING_MG = [
+    [-30, -40, -40, -50, -50, -40, -40, -30],
+    [-30, -40, -40, -50, -50, -40, -40, -30],
+    [-30, -40, -40, -50, -50, -40, -40, -30],
+    [-30, -40, -40, -50, -50, -40, -40, -30],
+    [-20, -30, -30, -40, -40, -30, -30, -20],
+    [-10, -20, -20, -20, -20, -20, -20, -10],
+    [20, 20, 0, 0, 0, 0, 20, 20],
+    [20, 30, 10, 0, 0, 10, 30, 20]
+]
+KING_EG = [
+    [-50, -40, -30, -20, -20, -30, -40, -50],
+    [-30, -20, -10, 0, 0, -10, -20, -30],
+    [-30, -10, 20, 30, 30, 20, -10, -30],
+    [-30, -10, 30, 40, 40, 30, -10, -30],
+    [-30, -10, 30, 40, 40, 30, -10, -30],
+    [-30, -10, 20, 30, 30, 20, -10, -30],
+    [-30, -30, 0, 0, 0, 0, -30, -30],
+    [-50, -30, -30, -30, -30, -30, -30, -50]
+]
+
+# pawn structure, per pawn; passed pawn bonuses are indexed by rank counted from the pawn's own side
+DOUBLED_PAWN = (-10, -20)
+ISOLATED_PAWN = (-15, -10)
+PASSED_PAWN_MG = [0, 5, 10, 15, 25, 40, 60, 0]
+PASSED_PAWN_EG = [0, 10, 15, 25, 45, 70, 110, 0]
+PAWN_CACHE_ENTRIES = 1 << 14
+
+PIECE_SQUARE_MG = {"P": PAWN_MG, "N": KNIGHT, "B": BISHOP, "R": ROCK, "Q": QUEEN, "K": KING_MG}
+PIECE_SQUARE_EG = {"P": PAWN_EG, "N": KNIGHT, "B": BISHOP, "R": ROCK, "Q": QUEEN, "K": KING_EG}
+
+
+def _combinedTable(values, tables):
+    # material + square bonus per piece name, positive for white and negative for black
+    combined = {}
+    for pieceType, table in tables.items():
+        combined["w" + pieceType] = [[values[pieceType] + table[r][c] for c in range(8)] for r in range(8)]
+        combined["b" + pieceType] = [[-(values[pieceType] + table[7 - r][c]) for c in range(8)] for r in range(8)]
+    return combined
+
+
+MG_TABLE = _combinedTable(PIECE_VALUES_MG, PIECE_SQUARE_MG)
+EG_TABLE = _combinedTable(PIECE_VALUES_EG, PIECE_SQUARE_EG)
+
+
+def taper(mg, eg, phase):
+    phase = min(phase, MAX_PHASE)
+    return (mg * phase + eg * (MAX_PHASE - phase)) // MAX_PHASE
+
+
+"""
+Pawn structure score (mg, eg) for white minus black, from the (r,c) squares of each side's pawns
+"""
+def pawnStructure(whitePawns, blackPawns):
+    whiteFiles = [[] for c in range(8)]
+    blackFiles = [[] for c in range(8)]
+    for r, c in whitePawns:
+        whiteFiles[c].append(r)
+    for r, c in blackPawns:
+        blackFiles[c].append(r)
+    mg = 0
+    eg = 0
+    for c in range(8):
+        neighbours = range(max(c - 1, 0), min(c + 2, 8))
+        for files, enemyFiles, sign in ((whiteFiles, blackFiles, 1), (blackFiles, whiteFiles, -1)):
+            rows = files[c]
+            if not rows:
+                continue
+            if len(rows) > 1:
+                mg += sign * DOUBLED_PAWN[0] * (len(rows) - 1)
+                eg += sign * DOUBLED_PAWN[1] * (len(rows) - 1)
+            if not any(files[f] for f in neighbours if f != c):
+                mg += sign * ISOLATED_PAWN[0] * len(rows)
+                eg += sign * ISOLATED_PAWN[1] * len(rows)
+            for r in rows:
+                # passed when no enemy pawn stands in front of it on its own or an adjacent file
+                if sign == 1:
+                    passed = not any(enemy < r for f in neighbours for enemy in enemyFiles[f])
+                    rank = 7 - r
+                else:
+                    passed = not any(enemy > r for f in neighbours for enemy in enemyFiles[f])
+                    rank = r
+                if passed:
+                    mg += sign * PASSED_PAWN_MG[rank]
+                    eg += sign * PASSED_PAWN_EG[rank]
+    return mg, eg
+
+
+"""
+(r,c) squares of the white and of the black pawns, from the piece lists, the bitboards or the board
+"""
+def pawnSquares(gs):
+    pieceSquares = getattr(gs, "pieceSquares", None)
+    if pieceSquares is not None:
+        return pieceSquares["wP"], pieceSquares["bP"]
+    pieces = getattr(gs, "pieces", None)
+    if pieces is not None: # bitboard backend, white pawns at index 0 and black pawns at 6
+        return ([divmod(sq, 8) for sq in range(64) if pieces[0] >> sq & 1],
+                [divmod(sq, 8) for sq in range(64) if pieces[6] >> sq & 1])
+    whitePawns = []
+    blackPawns = []
+    for r, row in enumerate(gs.board):
+        for c, piece in enumerate(row):
+            if piece == "wP":
+                whitePawns.append((r, c))
+            elif piece == "bP":
+                blackPawns.append((r, c))
+    return whitePawns, blackPawns
+
+
+"""
+Pawn structure scores keyed on the pawn zobrist key, a fixed number of slots where a new entry replaces the old one
+"""
+class PawnCache():
+    def __init__(self, entries=PAWN_CACHE_ENTRIES):
+        self.size = 1 << (max(entries, 1).bit_length() - 1)
+        self.mask = self.size - 1
+        self.keys = [0] * self.size
+        self.values = [None] * self.size
+        self.hits = 0
+        self.misses = 0
+
+    def probe(self, gs):
+        key = gs.pawnKey
+        i = key & self.mask
+        if self.keys[i] == key and self.values[i] is not None:
+            self.hits += 1
+            return self.values[i]
+        self.misses += 1
+        value = pawnStructure(*pawnSquares(gs))
+        self.keys[i] = key
+        self.values[i] = value
+        return value
+
+    def clear(self):
+        self.keys = [0] * self.size
+        self.values = [None] * self.size
+        self.hits = 0
+        self.misses = 0
+
+
+PAWN_CACHE = PawnCache()
+
+
+"""
+Score of the position in centipawns from the point of view of the side to move. Reads the incrementally kept scores
+and phase of the GameState plus the cached pawn structure term; positions without them are scanned in full.
+"""
+def evaluate(gs):
+    if hasattr(gs, "pawnKey"):
+        pawnMg, pawnEg = PAWN_CACHE.probe(gs)
+        score = taper(gs.mgScore + pawnMg, gs.egScore + pawnEg, gs.phase)
+        return score if gs.whiteToMove else -score
+    mg = 0
+    eg = 0
+    phase = 0
+    for r, row in enumerate(gs.board):
+        for c, piece in enumerate(row):
+            if piece != "--":
+                mg += MG_TABLE[piece][r][c]
+                eg += EG_TABLE[piece][r][c]
+                phase += PHASE_WEIGHTS[piece[1]]
+    pawnMg, pawnEg = pawnStructure(*pawnSquares(gs))
+    score = taper(mg + pawnMg, eg + pawnEg, phase)
+    return score if gs.whiteToMove else -score
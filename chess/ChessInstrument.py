@@ -0,0 +1,156 @@
+"""
+Opt-in instrumentation of the engine hot paths. enable() replaces the methods listed in TARGETS on their classes with
+wrappers that count calls and time them, disable() puts the originals back, so nothing is paid while it is off.
+Times are inclusive (getQueenMoves includes the getRockMoves/getBishopMoves calls it makes). Move allocations are the
+calls of Move.__init__. Methods are looked up on the class at every call, so enable() and disable() also apply to
+GameStates that already exist.
+
+Usage:
+    ChessInstrument.enable()
+    ... play or search ...
+    ChessInstrument.addSnapshot(statsFromAnotherProcess) # e.g. what ChessSearch.searchWorker sends back
+    print("\n".join(ChessInstrument.formatSnapshot(ChessInstrument.snapshot())))
+    ChessInstrument.dumpJson("instrumentation.json")
+
+    python ChessInstrument.py --depth 3 --backend bitboard --json stats.json
+"""
+import argparse
+import functools
+import json
+import sys
+import time
+
+import ChessBitboard
+import ChessEngine
+import ChessPerft
+
+TARGETS = {
+    ChessEngine.GameState: ("getValidMoves", "makeMove", "undoMove", "squareInCheck", "isSquareAttacked",
+                            "checkForPinsAndChecks", "getAllPossibleMoves", "getPawnMoves", "getRockMoves",
+                            "getKnightMoves", "getBishopMoves", "getQueenMoves", "getKingMoves", "getCastleMoves"),
+    ChessBitboard.BitboardGameState: ("getValidMoves", "getValidPackedMoves", "makeMove", "undoMove",
+                                      "makePackedMove", "undoPackedMove", "squareInCheck", "squareAttacked",
+                                      "getPawnMoves", "getCastleMoves"),
+    ChessEngine.Move: ("__init__", "fromPacked"),
+}
+
+_originals = {} # (class, name) -> attribute as found in the class dict
+_stats = {} # "Class.method" -> [calls, seconds]
+_started = time.perf_counter()
+
+
+def _timed(function, stat):
+    clock = time.perf_counter
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = clock()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stat[0] += 1
+            stat[1] += clock() - start
+    return wrapper
+
+
+def isEnabled():
+    return bool(_originals)
+
+
+def enable():
+    if _originals:
+        return
+    for cls, names in TARGETS.items():
+        for name in names:
+            original = cls.__dict__[name]
+            stat = _stats.setdefault(cls.__name__ + "." + name, [0, 0.0])
+            if isinstance(original, classmethod):
+                wrapped = classmethod(_timed(original.__func__, stat))
+            else:
+                wrapped = _timed(original, stat)
+            _originals[(cls, name)] = original
+            setattr(cls, name, wrapped)
+
+
+def disable():
+    for (cls, name), original in _originals.items():
+        setattr(cls, name, original)
+    _originals.clear()
+
+
+def reset():
+    global _started
+    for stat in _stats.values():
+        stat[0] = 0
+        stat[1] = 0.0
+    _started = time.perf_counter()
+
+
+"""
+Plain dict of the counters since the last reset, safe to json.dump: per method calls, total seconds and mean
+microseconds per call, plus the Move allocation count
+"""
+def snapshot():
+    calls = {}
+    for name, (count, seconds) in _stats.items():
+        if count:
+            calls[name] = {"calls": count, "seconds": seconds, "meanMicros": seconds * 1e6 / count}
+    allocations = _stats.get("Move.__init__", [0])[0]
+    return {"enabled": isEnabled(), "elapsed": time.perf_counter() - _started, "moveAllocations": allocations,
+            "calls": calls}
+
+
+"""
+Adds the counters of a snapshot taken elsewhere (such as the engine's search process) to the ones kept here
+"""
+def addSnapshot(stats):
+    for name, entry in stats["calls"].items():
+        stat = _stats.setdefault(name, [0, 0.0])
+        stat[0] += entry["calls"]
+        stat[1] += entry["seconds"]
+
+
+def dumpJson(destination, stats=None):
+    stats = snapshot() if stats is None else stats
+    if isinstance(destination, str):
+        with open(destination, "w") as out:
+            json.dump(stats, out, indent=2, sort_keys=True)
+    else:
+        json.dump(stats, destination, indent=2, sort_keys=True)
+
+
+"""
+Text lines of a snapshot, the methods with the most total time first
+"""
+def formatSnapshot(stats, limit=None):
+    lines = ["%-36s %9s %10s %9s" % ("method", "calls", "total ms", "mean us")]
+    ranked = sorted(stats["calls"].items(), key=lambda item: item[1]["seconds"], reverse=True)
+    for name, entry in ranked[:limit]:
+        lines.append("%-36s %9d %10.1f %9.2f" % (name, entry["calls"], entry["seconds"] * 1000, entry["meanMicros"]))
+    lines.append("Move allocations: %d in %.1fs" % (stats["moveAllocations"], stats["elapsed"]))
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run perft with instrumentation enabled and report the counters")
+    parser.add_argument("--fen", default=ChessEngine.STARTING_FEN)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--backend", choices=sorted(ChessPerft.BACKENDS), default="mailbox")
+    parser.add_argument("--json", help="also write the snapshot to this file")
+    args = parser.parse_args(argv)
+
+    enable()
+    reset()
+    gs = ChessPerft.BACKENDS[args.backend](args.fen)
+    nodes = ChessPerft.perft(gs, args.depth) # the Move path, so every layer is exercised
+    disable()
+    stats = snapshot()
+    print("%d nodes" % nodes)
+    print("\n".join(formatSnapshot(stats)))
+    if args.json:
+        dumpJson(args.json, stats)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+"""
+Load generator for ChessServer: keeps --concurrency random games going at once over a few pipelined connections until
+--games games have been played, then reports request latency percentiles, games/sec and how the games ended.
+
+Usage:
+    python ChessServer.py --port 8765 &
+    python ChessLoadClient.py --port 8765 --games 2000 --concurrency 1000 --connections 8
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import sys
+import time
+from collections import Counter
+
+from ChessServer import DEFAULT_HOST, DEFAULT_PORT, MAX_LINE
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+"""
+One TCP connection shared by many games: requests get increasing ids and a reader task hands every reply to the
+future waiting on its id
+"""
+class Connection():
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.ids = itertools.count(1)
+        self.waiting = {}
+        self.readerTask = asyncio.ensure_future(self.readReplies())
+
+    @classmethod
+    async def open(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port, limit=MAX_LINE)
+        return cls(reader, writer)
+
+    async def readReplies(self):
+        error = ConnectionError("connection closed by the server")
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                reply = json.loads(line)
+                future = self.waiting.pop(reply.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(reply)
+        except (ConnectionError, ValueError) as e:
+            error = e
+        for future in self.waiting.values():
+            if not future.done():
+                future.set_exception(error)
+        self.waiting.clear()
+
+    async def request(self, **request):
+        request["id"] = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[request["id"]] = future
+        self.writer.write(json.dumps(request).encode() + b"\n")
+        await self.writer.drain()
+        return await future
+
+    async def close(self):
+        self.writer.close()
+        await self.readerTask
+
+
+class LoadClient():
+    def __init__(self, connections, maxPlies=200, seed=0):
+        self.connections = connections
+        self.maxPlies = maxPlies
+        self.seed = seed
+        self.latencies = []
+        self.errors = Counter()
+        self.statuses = Counter()
+        self.plies = 0
+
+    async def timedRequest(self, connection, **request):
+        start = time.perf_counter()
+        reply = await connection.request(**request)
+        self.latencies.append(time.perf_counter() - start)
+        if not reply["ok"]:
+            self.errors[reply["error"].split(" ")[0]] += 1
+        return reply
+
+    """
+    Plays one game of random moves, returns its final status
+    """
+    async def playGame(self, gameNumber):
+        connection = self.connections[gameNumber % len(self.connections)]
+        rng = random.Random(self.seed + gameNumber)
+        reply = await self.timedRequest(connection, op="new")
+        if not reply["ok"]:
+            return "failed"
+        game = reply["game"]
+        plies = 0
+        while reply["status"] == "ongoing" and plies < self.maxPlies:
+            reply = await self.timedRequest(connection, op="move", game=game, move=rng.choice(reply["legal"]))
+            if not reply["ok"]:
+                break
+            plies += 1
+        self.plies += plies
+        await self.timedRequest(connection, op="close", game=game)
+        return reply.get("status", "failed") if reply["ok"] else "failed"
+
+    async def runner(self, gameNumbers):
+        for gameNumber in gameNumbers:
+            self.statuses[await self.playGame(gameNumber)] += 1
+
+    async def run(self, games, concurrency):
+        gameNumbers = iter(range(games)) # shared, so every runner picks up the next game when its own ends
+        start = time.perf_counter()
+        await asyncio.gather(*(self.runner(gameNumbers) for i in range(min(concurrency, games))))
+        return time.perf_counter() - start
+
+
+def percentile(ordered, p):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+"""
+Dict of the run statistics, latencies in milliseconds
+"""
+def report(client, games, seconds):
+    ordered = sorted(client.latencies)
+    stats = {"games": games, "seconds": seconds, "gamesPerSecond": games / seconds if seconds > 0 else 0.0,
+             "requests": len(ordered), "requestsPerSecond": len(ordered) / seconds if seconds > 0 else 0.0,
+             "plies": client.plies, "statuses": dict(client.statuses), "errors": dict(client.errors),
+             "latencyMs": {"p%g" % p: percentile(ordered, p) * 1000 for p in PERCENTILES}}
+    stats["latencyMs"]["max"] = ordered[-1] * 1000 if ordered else 0.0
+    return stats
+
+
+async def runLoad(host, port, games, concurrency, connectionCount, maxPlies, seed):
+    connections = [await Connection.open(host, port) for i in range(connectionCount)]
+    client = LoadClient(connections, maxPlies, seed)
+    try:
+        seconds = await client.run(games, concurrency)
+    finally:
+        for connection in connections:
+            await connection.close()
+    return report(client, games, seconds)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play random games against ChessServer and report latencies")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--games", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=100, help="games in progress at once")
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--max-plies", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0, help="game i picks its moves with seed + i")
+    parser.add_argument("--json", action="store_true", help="print the statistics as JSON")
+    args = parser.parse_args(argv)
+
+    stats = asyncio.run(runLoad(args.host, args.port, args.games, args.concurrency, max(args.connections, 1),
+                                args.max_plies, args.seed))
+    if args.json:
+        print(json.dumps(stats, indent=2, sort_keys=True))
+        return 0
+    print("%d games in %.2fs (%.2f games/sec), %d requests (%.0f/sec), %d plies" %
+          (stats["games"], stats["seconds"], stats["gamesPerSecond"], stats["requests"], stats["requestsPerSecond"],
+           stats["plies"]))
+    print("latency ms: " + ", ".join("%s %.2f" % item for item in stats["latencyMs"].items()))
+    for status, count in sorted(stats["statuses"].items()):
+        print("%-22s %d" % (status, count))
+    for error, count in sorted(stats["errors"].items()):
+        print("error %-16s %d" % (error, count))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,14 +2,35 @@
 This is main driver file. It will be responsible for handling user input and displaying current game state object.
 """
 
+import queue
+from multiprocessing import Process, Queue
+
 import pygame as p
 import ChessEngine
+import ChessBitboard
+import ChessInstrument
+import ChessSearch
 
 WIDTH = HEIGHT = 720
 DIMENSION = 8
 SQ_SIZE = HEIGHT//DIMENSION
-MAX_FPS = 15
+MAX_FPS = 15 # polling rate while the engine is thinking, an idle window sleeps until the next event
+ANIMATION_FPS = 60
+FRAMES_PER_SQUARE = 4 # animation length per square travelled
 IMAGES = {}
+USE_BITBOARDS = True # play on the bitboard backend instead of the list of strings GameState
+PLAYER_ONE_HUMAN = True # white is played with the mouse, False lets the engine play it
+PLAYER_TWO_HUMAN = False # same for black
+AI_MAX_DEPTH = 64
+AI_THINK_TIME = 2.0 # seconds per engine move
+BOOK_PATH = None # Polyglot .bin opening book the engine plays from while in book
+STATS_EVENT = p.USEREVENT + 1 # refreshes the instrumentation overlay while it is shown
+STATS_INTERVAL = 500 # ms
+STATS_PATH = "instrumentation.json"
+
+
+def newGameState():
+    return ChessBitboard.BitboardGameState() if USE_BITBOARDS else ChessEngine.GameState()
 
 
 def loadImages():
@@ -23,21 +44,33 @@ def main():
     clock = p.time.Clock()
     screen = p.display.set_mode((WIDTH,HEIGHT))
     screen.fill(p.Color("white"))
-    gs = ChessEngine.GameState()
+    p.event.set_blocked(p.MOUSEMOTION) # nothing reacts to motion, so it must not wake the loop
+    gs = newGameState()
     validMoves = gs.getValidMoves()
     moveMade = False #flag variable for a move is made
+    animate = False #flag variable for the move to be animated
     loadImages()
+    renderer = BoardRenderer(screen)
     running = True
     sqSelected = () #keep track of the last click of the user
     playerClicks = [] #keep track of player clicks
     gameOver = False
+    aiThinking = False # engine searching in a separate process so the window keeps responding
+    moveFinderProcess = None
+    returnQueue = None
+    showStats = False # instrumentation overlay, toggled with i, dumped to STATS_PATH with j
     while running:
-        for e in p.event.get():
+        humanTurn = (gs.whiteToMove and PLAYER_ONE_HUMAN) or (not gs.whiteToMove and PLAYER_TWO_HUMAN)
+        busy = not gameOver and not humanTurn # the engine queue has to be polled
+        events = p.event.get() if busy else [p.event.wait()] + p.event.get()
+        for e in events:
             # mouse press
             if e.type == p.QUIT:
                 running = False
+            elif e.type == p.VIDEOEXPOSE: # window contents were lost, repaint everything
+                renderer.invalidate()
             elif e.type == p.MOUSEBUTTONDOWN:
-                if not gameOver:
+                if not gameOver and humanTurn:
                     location = p.mouse.get_pos() # Get x,y of the mouse
                     col = location[0]//SQ_SIZE
                     row = location[1]//SQ_SIZE
@@ -55,98 +88,249 @@ def main():
                                 # print(move.getChessNotation())
                                 gs.makeMove(validMoves[i])
                                 moveMade = True
+                                animate = True
                                 sqSelected = ()
                                 playerClicks = []
+                                break
                         if not moveMade:
                             playerClicks = [sqSelected]
             #key handlers
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_z: # Undo the last Move
-                    log = gs.castleRightsLog[-1]
-                    #print(len(gs.castleRightsLog))
-                    #print(log.wks, log.wqs, log.bks, log.bqs)
+                    if aiThinking:
+                        moveFinderProcess.terminate()
+                        aiThinking = False
+                    gameOver = False
                     gs.undoMove()
-                    log = gs.castleRightsLog[-1]
-                    print(log.wks, log.wqs, log.bks, log.bqs)
                     moveMade = True
                     sqSelected = ()
                     playerClicks = []
                 if e.key == p.K_r: # Reset the game
-                    gs = ChessEngine.GameState()
+                    if aiThinking:
+                        moveFinderProcess.terminate()
+                        aiThinking = False
+                    gameOver = False
+                    gs = newGameState()
                     validMoves = gs.getValidMoves()
                     sqSelected = ()
                     playerClicks = []
+                if e.key == p.K_i: # Toggle the instrumentation overlay
+                    showStats = not showStats
+                    if showStats:
+                        ChessInstrument.reset()
+                        ChessInstrument.enable()
+                        p.time.set_timer(STATS_EVENT, STATS_INTERVAL)
+                    else:
+                        ChessInstrument.disable()
+                        p.time.set_timer(STATS_EVENT, 0)
+                if e.key == p.K_j: # Dump the instrumentation counters
+                    ChessInstrument.dumpJson(STATS_PATH)
+
+        # engine move finder, polled every frame until the search process reports its move
+        if not gameOver and not humanTurn:
+            if not aiThinking:
+                aiThinking = True
+                returnQueue = Queue()
+                notations = [move.getChessNotation() for move in gs.movelog]
+                moveFinderProcess = Process(target=ChessSearch.searchWorker, args=(type(gs), notations, AI_MAX_DEPTH, AI_THINK_TIME, returnQueue, BOOK_PATH, showStats))
+                moveFinderProcess.daemon = True
+                moveFinderProcess.start()
+            else:
+                try:
+                    aiNotation, engineStats = returnQueue.get_nowait()
+                except queue.Empty:
+                    aiNotation, engineStats = "", None
+                if engineStats is not None and showStats: # the search ran in its own process, fold its calls in
+                    ChessInstrument.addSnapshot(engineStats)
+                if aiNotation != "":
+                    aiThinking = False
+                    for move in validMoves:
+                        if move.getChessNotation() == aiNotation:
+                            gs.makeMove(move)
+                            moveMade = True
+                            animate = True
+                            break
 
         if moveMade:
-            # print(validMoves)
+            if animate:
+                animateMoves(gs.movelog[-1], renderer, gs.board, clock)
             validMoves = gs.getValidMoves()
             moveMade = False
+            animate = False
 
-        drawGameState(screen, gs,validMoves,sqSelected)
-
+        text = None
         if gs.checkMate:
             gameOver = True
             if gs.whiteToMove:
-                drawText(screen,"Black wins by Checkmate")
+                text = "Black wins by Checkmate"
             else:
-                drawText(screen,"White wins by Checkmate")
-        elif gs.staleMate:
+                text = "White wins by Checkmate"
+        elif gs.drawReason() is not None:
             gameOver = True
-            if gs.whiteToMove:
-                drawText(screen,"Black wins by Checkmate")
-            else:
-                drawText(screen,"White wins by Checkmate")
-        clock.tick(MAX_FPS)
-        p.display.flip()
+            text = "Draw by " + gs.drawReason()
+        overlay = ChessInstrument.formatSnapshot(ChessInstrument.snapshot(), 8) if showStats else None
+        renderer.render(gs, validMoves, sqSelected, text, overlay)
+        if busy:
+            clock.tick(MAX_FPS)
+
+
+def squareRect(r, c):
+    return p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+
+
+def squaresUnder(rect):
+    return [(r, c) for r in range(rect.top//SQ_SIZE, (rect.bottom-1)//SQ_SIZE + 1)
+            for c in range(rect.left//SQ_SIZE, (rect.right-1)//SQ_SIZE + 1)]
+
 
 """
-This fun. responsible for all the graphics within a current game state.
+Keeps what is on screen and repaints only the squares that differ from it. The board background, highlight surfaces,
+font and rendered texts are created once; every repaint blits a square of the background followed by its highlight and
+piece, and only the changed rectangles are pushed to the display.
 """
-def drawGameState(screen, gs, validMoves, sqSelected):
-    drawBoard(screen) #draw squares on the board
-    highlightSquares(screen,gs,validMoves,sqSelected)
-    drawPieces(screen, gs.board) #draw pieceson those squares and move suggestion later
-
-#This fun draw squares on boards
-def drawBoard(screen):
-    global colors
-    colors = [p.Color("white"), p.Color("gray")]
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            color = colors[((r+c)%2)]
-            p.draw.rect(screen, color, p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-
-def drawPieces(screen, board):
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            piece = board[r][c]
-            if piece!="--":
-                screen.blit(IMAGES[piece],p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-def highlightSquares(screen, gs, validMoves, sqSelected):
-    if sqSelected !=():
-        r,c = sqSelected
-        if gs.board[r][c][0]==("w" if gs.whiteToMove else "b"):
-            s = p.Surface((SQ_SIZE,SQ_SIZE))
-            s.set_alpha(100)
-            s.fill(p.Color('blue'))
-            screen.blit(s,(c*SQ_SIZE,r*SQ_SIZE))
-
-            s.fill(p.Color('yellow'))
-            for move in validMoves:
-                if move.startRow ==r and move.startCol==c:
-                    screen.blit(s,(SQ_SIZE*move.endCol,move.endRow*SQ_SIZE))
-
-def animateMoves(move,screen,board,clock):
-    global colors
-    coords = []
-
-def drawText(screen,text):
-    font = p.font.SysFont('Helvitca',46,True,False)
-    textObject = font.render(text,0,p.Color('Blue'))
-    textLocation = p.Rect(0,0,WIDTH,HEIGHT).move(WIDTH/2-textObject.get_width()/2,HEIGHT/2-textObject.get_height()/2)
-    screen.blit(textObject,textLocation)
+class BoardRenderer():
+    def __init__(self, screen):
+        self.screen = screen
+        colors = [p.Color("white"), p.Color("gray")]
+        self.background = p.Surface((WIDTH, HEIGHT)).convert()
+        for r in range(DIMENSION):
+            for c in range(DIMENSION):
+                p.draw.rect(self.background, colors[(r+c)%2], squareRect(r, c))
+        self.selectedSurface = self.highlightSurface('blue')
+        self.targetSurface = self.highlightSurface('yellow')
+        self.font = p.font.SysFont('Helvitca',46,True,False)
+        self.overlayFont = p.font.SysFont('monospace',13)
+        self.textSurfaces = {}
+        self.shownBoard = None # board as last drawn, None forces a full repaint
+        self.shownHighlights = {}
+        self.shownText = None
+        self.shownOverlay = None
+        self.shownOverlayRect = None
+
+    def highlightSurface(self, color):
+        s = p.Surface((SQ_SIZE,SQ_SIZE))
+        s.set_alpha(100)
+        s.fill(p.Color(color))
+        return s
+
+    def invalidate(self):
+        self.shownBoard = None
+
+    def drawSquare(self, r, c, piece, highlight=None):
+        rect = squareRect(r, c)
+        self.screen.blit(self.background, rect, rect)
+        if highlight is not None:
+            self.screen.blit(highlight, rect)
+        if piece != "--":
+            self.screen.blit(IMAGES[piece], rect)
+        return rect
+
+    """
+    Repaints the squares of rect from board, with pieces replaced by overrides[(r,c)] where given. Used by animations,
+    which draw the moving piece on top afterwards.
+    """
+    def restore(self, rect, board, overrides):
+        for r, c in squaresUnder(rect):
+            self.drawSquare(r, c, overrides.get((r,c), board[r][c]))
+
+    def highlights(self, gs, validMoves, sqSelected):
+        highlights = {}
+        if sqSelected !=():
+            r,c = sqSelected
+            if gs.board[r][c][0]==("w" if gs.whiteToMove else "b"):
+                highlights[(r,c)] = self.selectedSurface
+                for move in validMoves:
+                    if move.startRow ==r and move.startCol==c:
+                        highlights[(move.endRow,move.endCol)] = self.targetSurface
+        return highlights
+
+    def textSurface(self, text):
+        if text not in self.textSurfaces:
+            self.textSurfaces[text] = self.font.render(text,0,p.Color('Blue'))
+        return self.textSurfaces[text]
+
+    def textRect(self, text):
+        textObject = self.textSurface(text)
+        return p.Rect(0,0,WIDTH,HEIGHT).move(WIDTH/2-textObject.get_width()/2,HEIGHT/2-textObject.get_height()/2).clip(p.Rect(0,0,WIDTH,HEIGHT))
+
+    def overlayRect(self, lines):
+        lineHeight = self.overlayFont.get_linesize()
+        return p.Rect(0, 0, WIDTH, lineHeight*len(lines) + 8)
+
+    def drawOverlay(self, lines, rect):
+        panel = p.Surface(rect.size)
+        panel.set_alpha(190)
+        panel.fill(p.Color('black'))
+        self.screen.blit(panel, rect)
+        lineHeight = self.overlayFont.get_linesize()
+        for i, line in enumerate(lines):
+            self.screen.blit(self.overlayFont.render(line, True, p.Color('white')), (rect.left + 6, rect.top + 4 + i*lineHeight))
+
+    """
+    Brings the screen up to date with gs and pushes only the changed squares to the display. Returns the dirty rects.
+    """
+    def render(self, gs, validMoves, sqSelected, text=None, overlay=None):
+        board = gs.board
+        highlights = self.highlights(gs, validMoves, sqSelected)
+        if self.shownBoard is None:
+            changed = set((r, c) for r in range(DIMENSION) for c in range(DIMENSION))
+        else:
+            changed = set()
+            for r in range(DIMENSION):
+                if board[r] != self.shownBoard[r]:
+                    changed.update((r, c) for c in range(DIMENSION) if board[r][c] != self.shownBoard[r][c])
+            for square in highlights.keys() | self.shownHighlights.keys():
+                if highlights.get(square) is not self.shownHighlights.get(square):
+                    changed.add(square)
+            if self.shownText is not None and text != self.shownText:
+                changed.update(squaresUnder(self.textRect(self.shownText)))
+            if self.shownOverlay is not None and overlay != self.shownOverlay:
+                changed.update(squaresUnder(self.shownOverlayRect))
+        # the overlay is translucent, so it is only ever drawn over freshly painted squares
+        overlayRect = self.overlayRect(overlay) if overlay is not None else None
+        if overlay is not None and (changed or overlay != self.shownOverlay):
+            changed.update(squaresUnder(overlayRect))
+        dirty = [self.drawSquare(r, c, board[r][c], highlights.get((r, c))) for r, c in changed]
+        if text is not None and (dirty or text != self.shownText):
+            rect = self.textRect(text)
+            self.screen.blit(self.textSurface(text), rect)
+            dirty.append(rect)
+        if overlay is not None and dirty:
+            self.drawOverlay(overlay, overlayRect)
+        self.shownBoard = [list(row) for row in board]
+        self.shownHighlights = highlights
+        self.shownText = text
+        self.shownOverlay = overlay
+        self.shownOverlayRect = overlayRect
+        if dirty:
+            p.display.update(dirty)
+        return dirty
+
+
+"""
+Slides the piece of a move that was just made from its start to its end square. board is already the position after
+the move, so the captured piece is put back on its square until the moving piece lands. Each frame repaints only the
+squares under the piece's previous and new position.
+"""
+def animateMoves(move,renderer,board,clock):
+    dR = move.endRow - move.startRow
+    dC = move.endCol - move.startCol
+    frameCount = max(abs(dR), abs(dC))*FRAMES_PER_SQUARE
+    overrides = {(move.endRow,move.endCol): "--" if move.isEnPassantMove else move.pieceCaptured}
+    if move.isEnPassantMove:
+        overrides[(move.startRow,move.endCol)] = move.pieceCaptured
+    previous = squareRect(move.startRow, move.startCol)
+    for frame in range(1, frameCount+1):
+        r = move.startRow + dR*frame/frameCount
+        c = move.startCol + dC*frame/frameCount
+        pieceRect = p.Rect(round(c*SQ_SIZE), round(r*SQ_SIZE), SQ_SIZE, SQ_SIZE)
+        dirty = previous.union(pieceRect)
+        renderer.restore(dirty, board, overrides)
+        renderer.screen.blit(IMAGES[move.pieceMoved], pieceRect)
+        p.display.update(dirty)
+        previous = pieceRect
+        clock.tick(ANIMATION_FPS)
+
 
 if __name__ == "__main__":
     main()
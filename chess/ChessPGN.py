@@ -0,0 +1,209 @@
+"""
+Streaming PGN import/export. readGames walks a PGN file line by line and yields one game at a time, so archives of any
+size are read in constant memory. replayGames checks every game by playing its SAN moves through GameState.makeMove on
+a process pool, keeping only a bounded number of games in flight, and yields one result per game in file order.
+
+Usage:
+    python ChessPGN.py games.pgn --processes 4
+"""
+import argparse
+import re
+import sys
+import time
+from collections import deque
+from multiprocessing import Pool
+
+import ChessEngine
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+HEADER_PATTERN = re.compile(r'^\[(\w+)\s+"(.*)"\]\s*$')
+# comments, variations and NAGs are skipped when reading the main line
+MOVE_NUMBER_PATTERN = re.compile(r"^\d+\.+")
+
+
+class PgnGame():
+    def __init__(self, headers, movetext, index):
+        self.headers = headers
+        self.movetext = movetext
+        self.index = index
+
+
+"""
+Yields a PgnGame for every game in a PGN file (path or open text file), holding only the current game in memory
+"""
+def readGames(source):
+    handle = open(source, encoding="utf-8", errors="replace") if isinstance(source, str) else source
+    try:
+        headers = {}
+        movetext = []
+        index = 0
+        for line in handle:
+            line = line.strip()
+            if line.startswith("["):
+                if movetext: # a header after movetext starts the next game
+                    yield PgnGame(headers, "\n".join(movetext), index)
+                    index += 1
+                    headers = {}
+                    movetext = []
+                match = HEADER_PATTERN.match(line)
+                if match:
+                    headers[match.group(1)] = match.group(2).replace('\\"', '"')
+            elif line and not line.startswith("%"):
+                movetext.append(line) # joined with newlines, a ; comment only runs to the end of its line
+        if headers or movetext:
+            yield PgnGame(headers, "\n".join(movetext), index)
+    finally:
+        if handle is not source:
+            handle.close()
+
+
+"""
+SAN tokens of the main line, dropping move numbers, {comments}, ; comments, (variations), $NAGs and the result
+"""
+def parseMovetext(movetext):
+    tokens = []
+    depth = 0
+    i = 0
+    length = len(movetext)
+    while i < length:
+        ch = movetext[i]
+        if ch == "{":
+            end = movetext.find("}", i)
+            i = length if end < 0 else end + 1
+            continue
+        if ch == ";":
+            end = movetext.find("\n", i)
+            i = length if end < 0 else end + 1
+            continue
+        if ch == "(":
+            depth += 1
+            i += 1
+            continue
+        if ch == ")":
+            depth -= 1
+            i += 1
+            continue
+        if ch.isspace():
+            i += 1
+            continue
+        end = i
+        while end < length and not movetext[end].isspace() and movetext[end] not in "{;()":
+            end += 1
+        token = movetext[i:end]
+        i = end
+        if depth > 0 or token.startswith("$") or token in RESULTS:
+            continue
+        token = MOVE_NUMBER_PATTERN.sub("", token)
+        if token:
+            tokens.append(token)
+    return tokens
+
+
+"""
+Plays a game through makeMove and reports whether every move was legal. Returns a dict with the game index, the main
+headers, the number of plies played, the final FEN and the first error if any.
+"""
+def replayGame(game):
+    fen = game.headers.get("FEN", ChessEngine.STARTING_FEN)
+    result = {"index": game.index, "white": game.headers.get("White", "?"), "black": game.headers.get("Black", "?"),
+              "result": game.headers.get("Result", "*"), "plies": 0, "valid": True, "error": None}
+    try:
+        gs = ChessEngine.GameState(fen)
+    except Exception as e: # a broken header must not abort the replay of the rest of the file
+        result["valid"] = False
+        result["error"] = "FEN header: %s" % e
+        return result
+    try:
+        for san in parseMovetext(game.movetext):
+            gs.makeMove(ChessEngine.Move.fromSan(san, gs))
+            result["plies"] += 1
+        result["finalFen"] = gs.getFen()
+    except Exception as e: # whatever a broken game raises, it is reported for that game alone
+        result["valid"] = False
+        message = str(e) if isinstance(e, ValueError) else "%s: %s" % (type(e).__name__, e)
+        result["error"] = "ply %d: %s" % (result["plies"] + 1, message)
+    return result
+
+
+"""
+Replays every game of a PGN file, yielding results in file order. With processes > 1 the games are spread over a
+pool while at most maxInFlight games are read ahead, so memory stays constant however large the file is.
+"""
+def replayGames(source, processes=1, maxInFlight=None):
+    games = readGames(source)
+    if processes <= 1:
+        for game in games:
+            yield replayGame(game)
+        return
+    if maxInFlight is None:
+        maxInFlight = processes * 16
+    with Pool(processes) as pool:
+        pending = deque()
+        for game in games:
+            pending.append(pool.apply_async(replayGame, (game,)))
+            if len(pending) >= maxInFlight:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+"""
+PGN text of one game from its headers and SAN moves, with the seven tag roster first and the movetext wrapped at 80
+columns
+"""
+def gameToPgn(headers, sanMoves, result="*", startFullmoveNumber=1, blackStarts=False):
+    headers = dict(headers)
+    headers["Result"] = result
+    lines = []
+    for tag in ("Event", "Site", "Date", "Round", "White", "Black", "Result"):
+        lines.append('[%s "%s"]' % (tag, str(headers.pop(tag, "?")).replace('"', '\\"')))
+    for tag, value in headers.items():
+        lines.append('[%s "%s"]' % (tag, str(value).replace('"', '\\"')))
+    lines.append("")
+    tokens = []
+    moveNumber = startFullmoveNumber
+    for i, san in enumerate(sanMoves):
+        whiteMove = (i % 2 == 0) != blackStarts
+        if whiteMove:
+            tokens.append("%d." % moveNumber)
+        elif i == 0:
+            tokens.append("%d..." % moveNumber)
+        tokens.append(san)
+        if not whiteMove:
+            moveNumber += 1
+    tokens.append(result)
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > 80:
+            lines.append(line)
+            line = token
+        else:
+            line = line + " " + token if line else token
+    lines.append(line)
+    return "\n".join(lines) + "\n\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay and validate every game of a PGN file")
+    parser.add_argument("pgn")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--quiet", action="store_true", help="only print invalid games and the summary")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    games = invalid = plies = 0
+    for result in replayGames(args.pgn, args.processes):
+        games += 1
+        plies += result["plies"]
+        if not result["valid"]:
+            invalid += 1
+            print("game %d (%s - %s): %s" % (result["index"] + 1, result["white"], result["black"], result["error"]))
+        elif not args.quiet:
+            print("game %d (%s - %s): %d plies, %s" % (result["index"] + 1, result["white"], result["black"], result["plies"], result["result"]))
+    seconds = time.perf_counter() - start
+    print("%d games, %d invalid, %d plies in %.2fs (%.1f games/sec)" % (games, invalid, plies, seconds, games / seconds if seconds > 0 else 0))
+    return 0 if invalid == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
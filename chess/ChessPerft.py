@@ -0,0 +1,164 @@
+"""
+Headless perft (move path enumeration) for benchmarking and validating move generation. Counts the leaf nodes of the
+legal move tree to a fixed depth, prints per root move "divide" counts and reports wall time and nodes/sec. The
+reference positions below have well known node counts, so a mismatch points straight at a move generation bug.
+
+Usage:
+    python ChessPerft.py --depth 4
+    python ChessPerft.py --fen "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1" --depth 3 --divide
+    python ChessPerft.py --suite --max-nodes 200000 --backend bitboard --processes 4
+"""
+import argparse
+import sys
+import time
+from multiprocessing import Pool
+
+import ChessEngine
+import ChessBitboard
+
+BACKENDS = {"mailbox": ChessEngine.GameState, "bitboard": ChessBitboard.BitboardGameState}
+
+# (name, fen, node counts for depth 1, 2, 3, ...)
+REFERENCE_POSITIONS = [
+    ("startpos", ChessEngine.STARTING_FEN,
+     [20, 400, 8902, 197281, 4865609]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603]),
+    ("position3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     [14, 191, 2812, 43238, 674624]),
+    ("position4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333]),
+    ("position5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379, 2103487]),
+    ("position6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594]),
+]
+
+
+def perft(gs, depth):
+    if depth == 0:
+        return 1
+    moves = gs.getValidMoves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+
+"""
+The bitboard backend can stay on packed integer moves the whole way down, skipping Move objects entirely and reusing
+one move buffer per ply
+"""
+def perftPacked(gs, depth, buffers, ply=0):
+    if depth == 0:
+        return 1
+    moves = gs.getValidPackedMoves(buffers.get(ply))
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.makePackedMove(move)
+        nodes += perftPacked(gs, depth - 1, buffers, ply + 1)
+        gs.undoPackedMove()
+    return nodes
+
+
+def countNodes(gs, depth):
+    if isinstance(gs, ChessBitboard.BitboardGameState):
+        return perftPacked(gs, depth, ChessBitboard.MoveBufferStack(depth + 1))
+    return perft(gs, depth)
+
+
+def _divideWorker(args):
+    backend, fen, notation, depth = args
+    gs = BACKENDS[backend](fen)
+    gs.makeMove(ChessEngine.moveFromNotation(gs, notation))
+    return notation, countNodes(gs, depth - 1)
+
+
+"""
+Node count below every root move, as {coordinate notation: nodes}. With processes > 1 the root moves are spread over a
+process pool, each worker rebuilding the position from the FEN.
+"""
+def divide(fen, depth, backend="mailbox", processes=1):
+    gs = BACKENDS[backend](fen)
+    notations = [move.getChessNotation() for move in gs.getValidMoves()]
+    jobs = [(backend, fen, notation, depth) for notation in notations]
+    if processes > 1 and len(jobs) > 1:
+        with Pool(processes) as pool:
+            results = pool.map(_divideWorker, jobs)
+    else:
+        results = [_divideWorker(job) for job in jobs]
+    return dict(results)
+
+
+"""
+Runs perft and returns (nodes, seconds). Uses divide when a pool is requested so all cores share the work.
+"""
+def timedPerft(fen, depth, backend="mailbox", processes=1):
+    start = time.perf_counter()
+    if processes > 1 and depth > 1:
+        nodes = sum(divide(fen, depth, backend, processes).values())
+    else:
+        nodes = countNodes(BACKENDS[backend](fen), depth)
+    return nodes, time.perf_counter() - start
+
+
+def formatRate(nodes, seconds):
+    return "%d nodes in %.3fs (%.0f nodes/sec)" % (nodes, seconds, nodes / seconds if seconds > 0 else 0)
+
+
+"""
+Checks every reference position at every depth whose expected count is at most maxNodes. Returns True if all match.
+"""
+def runSuite(maxNodes=100000, backend="mailbox", processes=1, out=sys.stdout):
+    allPassed = True
+    totalNodes = 0
+    totalSeconds = 0.0
+    for name, fen, expectedCounts in REFERENCE_POSITIONS:
+        for depth, expected in enumerate(expectedCounts, 1):
+            if expected > maxNodes:
+                break
+            nodes, seconds = timedPerft(fen, depth, backend, processes)
+            totalNodes += nodes
+            totalSeconds += seconds
+            status = "ok" if nodes == expected else "FAIL (expected %d)" % expected
+            allPassed = allPassed and nodes == expected
+            out.write("%-10s depth %d: %s %s\n" % (name, depth, formatRate(nodes, seconds), status))
+    out.write("total: %s\n" % formatRate(totalNodes, totalSeconds))
+    return allPassed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perft benchmark and move generation check")
+    parser.add_argument("--fen", default=ChessEngine.STARTING_FEN, help="position to search (default: start position)")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--divide", action="store_true", help="print the node count below every root move")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="mailbox")
+    parser.add_argument("--processes", type=int, default=1, help="split root moves across this many processes")
+    parser.add_argument("--suite", action="store_true", help="check all reference positions instead of --fen")
+    parser.add_argument("--max-nodes", type=int, default=100000, help="largest expected count --suite will run")
+    args = parser.parse_args(argv)
+
+    if args.suite:
+        return 0 if runSuite(args.max_nodes, args.backend, args.processes) else 1
+
+    start = time.perf_counter()
+    if args.divide:
+        counts = divide(args.fen, args.depth, args.backend, args.processes)
+        for notation in sorted(counts):
+            print("%s: %d" % (notation, counts[notation]))
+        nodes = sum(counts.values())
+        print("moves: %d" % len(counts))
+    else:
+        nodes, _ = timedPerft(args.fen, args.depth, args.backend, args.processes)
+    print(formatRate(nodes, time.perf_counter() - start))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,419 @@
+"""
+Computer opponent: negamax alpha-beta search with iterative deepening, a quiescence search over captures, a
+transposition table, and move ordering by hash move, MVV-LVA captures, killer moves and the history heuristic.
+Searches stop on a depth, time or node limit (or a multiprocessing/threading Event), always returning the best move
+of the deepest fully searched iteration. Works on any GameState backend through getValidMoves/makeMove/undoMove;
+below the root a backend with getValidPackedMoves (BitboardGameState) is searched on packed integers instead, filled
+into one MoveBufferStack array per ply and played with makePackedMove/undoPackedMove, so no Move objects are built.
+"""
+import time
+
+import ChessBitboard
+import ChessEngine
+import ChessEvaluation
+
+MATE_SCORE = 100000
+MATE_THRESHOLD = MATE_SCORE - 1000 # scores beyond this are mates, stored relative to the node in the table
+INFINITY = 1000000
+EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2
+MAX_PLY = 128
+CHECK_EVERY = 512 # nodes between time/stop checks
+
+# rough piece values for MVV-LVA (most valuable victim, least valuable attacker) ordering
+ORDER_VALUES = {"P": 1, "N": 3, "B": 3, "R": 5, "Q": 9, "K": 20}
+ORDER_VALUES_BY_CODE = [ORDER_VALUES[piece[1]] for piece in ChessBitboard.PIECES] # by bitboard piece code
+PACKED_ENPASSANT = ChessEngine.Move.FLAG_ENPASSANT << 12
+PACKED_PROMOTION = ChessEngine.Move.FLAG_PROMOTION << 12
+HASH_MOVE_SCORE = 10000000
+CAPTURE_SCORE = 1000000
+PROMOTION_SCORE = 900000
+KILLER_SCORE = 800000
+HISTORY_LIMIT = 700000
+
+
+class SearchResult():
+    def __init__(self):
+        self.bestMove = None
+        self.score = 0
+        self.depth = 0
+        self.nodes = 0
+        self.seconds = 0.0
+        self.pv = []
+
+
+class Searcher():
+    def __init__(self, transpositionTable=None, tablebase=None):
+        self.tt = transpositionTable if transpositionTable is not None else ChessEngine.TranspositionTable(16, entryBytes=128)
+        self.tablebase = tablebase # ChessTablebase.Tablebase giving exact scores once few pieces are left
+        self.killers = [[None, None] for i in range(MAX_PLY)]
+        self.history = {}
+        self.nodes = 0
+        self.stopped = False
+        self.deadline = None
+        self.nodeLimit = None
+        self.stopEvent = None
+        self.buffers = ChessBitboard.MoveBufferStack(MAX_PLY)
+        self.packed = False # whether the current search runs on packed moves below the root
+
+    """
+    Iterative deepening from depth 1 up to maxDepth. timeLimit is in seconds. onIteration(result) is called after each
+    completed depth, e.g. to print UCI info lines.
+    """
+    def search(self, gs, maxDepth=64, timeLimit=None, nodeLimit=None, stopEvent=None, onIteration=None):
+        start = time.perf_counter()
+        self.nodes = 0
+        self.stopped = False
+        self.deadline = start + timeLimit if timeLimit is not None else None
+        self.nodeLimit = nodeLimit
+        self.stopEvent = stopEvent
+        self.killers = [[None, None] for i in range(MAX_PLY)]
+        self.packed = hasattr(gs, "getValidPackedMoves")
+        self.tt.newSearch()
+
+        result = SearchResult()
+        rootMoves = gs.getValidMoves()
+        if not rootMoves:
+            return result
+        result.bestMove = rootMoves[0]
+        for depth in range(1, maxDepth + 1):
+            score, bestMove = self.searchRoot(gs, rootMoves, depth)
+            if self.stopped:
+                break
+            result.bestMove = bestMove
+            result.score = score
+            result.depth = depth
+            result.nodes = self.nodes
+            result.seconds = time.perf_counter() - start
+            result.pv = self.principalVariation(gs, depth)
+            if onIteration is not None:
+                onIteration(result)
+            if abs(score) >= MATE_THRESHOLD:
+                break
+            # search the best move of this iteration first in the next one
+            rootMoves.remove(bestMove)
+            rootMoves.insert(0, bestMove)
+        result.nodes = self.nodes
+        result.seconds = time.perf_counter() - start
+        return result
+
+    def searchRoot(self, gs, rootMoves, depth):
+        alpha = -INFINITY
+        beta = INFINITY
+        bestMove = rootMoves[0]
+        for move in rootMoves:
+            gs.makeMove(move)
+            score = -self.negamax(gs, depth - 1, -beta, -alpha, 1)
+            gs.undoMove()
+            if self.stopped:
+                break
+            if score > alpha:
+                alpha = score
+                bestMove = move
+        if not self.stopped:
+            self.tt.store(gs.zobristKey, (depth, alpha, EXACT, bestMove.moveId), depth)
+        return alpha, bestMove
+
+    def negamax(self, gs, depth, alpha, beta, ply):
+        if self.checkLimits():
+            return 0
+        # a position already seen in the game or on this path, or fifty moves without progress, is scored as a draw
+        if gs.positionCounts.get(gs.zobristKey, 0) > 1 or gs.halfmoveClockLog[-1] >= 100:
+            return 0
+        if self.tablebase is not None and self.tablebase.canProbe(gs):
+            result = self.tablebase.probe(gs)
+            if result is not None:
+                self.nodes += 1
+                wdl, dtm = result
+                if wdl > 0:
+                    return MATE_SCORE - ply - dtm
+                return -MATE_SCORE + ply + dtm if wdl < 0 else 0
+        if depth <= 0 or ply >= MAX_PLY - 1:
+            return self.quiescence(gs, alpha, beta, ply)
+        self.nodes += 1
+        alphaOrig = alpha
+        key = gs.zobristKey
+        hashMoveId = None
+        entry = self.tt.probe(key)
+        if entry is not None:
+            entryDepth, entryScore, entryFlag, hashMoveId = entry
+            if entryDepth >= depth:
+                entryScore = scoreFromTable(entryScore, ply)
+                if entryFlag == EXACT:
+                    return entryScore
+                elif entryFlag == LOWER_BOUND:
+                    alpha = max(alpha, entryScore)
+                else:
+                    beta = min(beta, entryScore)
+                if alpha >= beta:
+                    return entryScore
+
+        if self.packed:
+            best, bestMoveId = self.searchPackedMoves(gs, depth, alpha, beta, ply, hashMoveId)
+        else:
+            best, bestMoveId = self.searchMoves(gs, depth, alpha, beta, ply, hashMoveId)
+        if self.stopped:
+            return 0
+        if bestMoveId is None: # no legal move, mate or stalemate
+            return best
+
+        if best <= alphaOrig:
+            flag = UPPER_BOUND
+        elif best >= beta:
+            flag = LOWER_BOUND
+        else:
+            flag = EXACT
+        self.tt.store(key, (depth, scoreToTable(best, ply), flag, bestMoveId), depth)
+        return best
+
+    """
+    The move loop of negamax, returning the best score and the moveId of the best move (None without legal moves)
+    """
+    def searchMoves(self, gs, depth, alpha, beta, ply, hashMoveId):
+        moves = gs.getValidMoves()
+        if not moves:
+            return (-MATE_SCORE + ply if gs.checkMate else 0), None
+        side = 0 if gs.whiteToMove else 1
+        killers = self.killers[ply]
+        moves.sort(key=lambda move: self.orderScore(move, hashMoveId, killers, side), reverse=True)
+
+        best = -INFINITY
+        bestMove = moves[0]
+        for move in moves:
+            gs.makeMove(move)
+            score = -self.negamax(gs, depth - 1, -beta, -alpha, ply + 1)
+            gs.undoMove()
+            if self.stopped:
+                return 0, None
+            if score > best:
+                best = score
+                bestMove = move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if move.pieceCaptured == "--" and not move.isPawnPromotion:
+                            self.rememberQuietCutoff(move.moveId, ply, side, depth)
+                        break
+        return best, bestMove.moveId
+
+    """
+    searchMoves on packed moves: generated into this ply's buffer, ordered by the same scores and played without
+    going through Move or movelog
+    """
+    def searchPackedMoves(self, gs, depth, alpha, beta, ply, hashMoveId):
+        moves = gs.getValidPackedMoves(self.buffers.get(ply))
+        if not moves:
+            return (-MATE_SCORE + ply if gs.checkMate else 0), None
+        side = 0 if gs.whiteToMove else 1
+        killers = self.killers[ply]
+        squares = gs.squares
+        moves = sorted(moves, key=lambda packed: self.packedOrderScore(packed, squares, hashMoveId, killers, side),
+                       reverse=True)
+
+        best = -INFINITY
+        bestMove = moves[0]
+        for packed in moves:
+            gs.makePackedMove(packed)
+            score = -self.negamax(gs, depth - 1, -beta, -alpha, ply + 1)
+            gs.undoPackedMove()
+            if self.stopped:
+                return 0, None
+            if score > best:
+                best = score
+                bestMove = packed
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if squares[(packed >> 6) & 63] == ChessBitboard.EMPTY and \
+                                not packed & (PACKED_ENPASSANT | PACKED_PROMOTION):
+                            self.rememberQuietCutoff(packedMoveId(packed), ply, side, depth)
+                        break
+        return best, packedMoveId(bestMove)
+
+    """
+    Only captures (and queen promotions) are searched until the position is quiet, so the static evaluation is never
+    taken in the middle of an exchange. When in check every evasion is searched instead.
+    """
+    def quiescence(self, gs, alpha, beta, ply):
+        self.nodes += 1
+        if self.checkLimits():
+            return 0
+        inCheck = gs.inCheck()
+        if not inCheck:
+            standPat = ChessEvaluation.evaluate(gs)
+            if standPat >= beta or ply >= MAX_PLY - 1:
+                return standPat
+            alpha = max(alpha, standPat)
+        if self.packed:
+            moves = gs.getValidPackedMoves(self.buffers.get(ply))
+            makeMove, undoMove = gs.makePackedMove, gs.undoPackedMove
+        else:
+            moves = gs.getValidMoves()
+            makeMove, undoMove = gs.makeMove, gs.undoMove
+        if not moves:
+            return -MATE_SCORE + ply if gs.checkMate else 0
+        if self.packed:
+            squares = gs.squares
+            if not inCheck:
+                moves = [packed for packed in moves if squares[(packed >> 6) & 63] != ChessBitboard.EMPTY or
+                         packed & PACKED_ENPASSANT or packed >> 15 == ChessEngine.Move.promotionTypes["Q"]]
+            moves = sorted(moves, key=lambda packed: packedMvvLva(packed, squares), reverse=True)
+        else:
+            if not inCheck:
+                moves = [move for move in moves if move.pieceCaptured != "--" or (move.isPawnPromotion and move.promotionChoice == "Q")]
+            moves.sort(key=mvvLva, reverse=True)
+        best = alpha if not inCheck else -INFINITY
+        for move in moves:
+            makeMove(move)
+            score = -self.quiescence(gs, -beta, -alpha, ply + 1)
+            undoMove()
+            if self.stopped:
+                return 0
+            if score > best:
+                best = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return best
+
+    def orderScore(self, move, hashMoveId, killers, side):
+        if move.moveId == hashMoveId:
+            return HASH_MOVE_SCORE
+        if move.pieceCaptured != "--":
+            return CAPTURE_SCORE + mvvLva(move)
+        if move.isPawnPromotion:
+            return PROMOTION_SCORE + ORDER_VALUES[move.promotionChoice]
+        if move.moveId == killers[0] or move.moveId == killers[1]:
+            return KILLER_SCORE
+        return self.history.get(side * 100000 + move.moveId, 0)
+
+    def packedOrderScore(self, packed, squares, hashMoveId, killers, side):
+        moveId = packedMoveId(packed)
+        if moveId == hashMoveId:
+            return HASH_MOVE_SCORE
+        if squares[(packed >> 6) & 63] != ChessBitboard.EMPTY or packed & PACKED_ENPASSANT:
+            return CAPTURE_SCORE + packedMvvLva(packed, squares)
+        if packed & PACKED_PROMOTION:
+            return PROMOTION_SCORE + ORDER_VALUES[ChessEngine.Move.promotionNames[packed >> 15]]
+        if moveId == killers[0] or moveId == killers[1]:
+            return KILLER_SCORE
+        return self.history.get(side * 100000 + moveId, 0)
+
+    def rememberQuietCutoff(self, moveId, ply, side, depth):
+        killers = self.killers[ply]
+        if killers[0] != moveId:
+            killers[1] = killers[0]
+            killers[0] = moveId
+        key = side * 100000 + moveId
+        self.history[key] = self.history.get(key, 0) + depth * depth
+        if self.history[key] > HISTORY_LIMIT: # keep history below the killer/capture scores
+            for k in self.history:
+                self.history[k] //= 2
+
+    def checkLimits(self):
+        if self.stopped:
+            return True
+        if self.nodeLimit is not None and self.nodes >= self.nodeLimit:
+            self.stopped = True
+        elif self.nodes % CHECK_EVERY == 0:
+            if self.deadline is not None and time.perf_counter() >= self.deadline:
+                self.stopped = True
+            elif self.stopEvent is not None and self.stopEvent.is_set():
+                self.stopped = True
+        return self.stopped
+
+    """
+    Follows the hash moves from the root, used for reporting only
+    """
+    def principalVariation(self, gs, depth):
+        pv = []
+        for i in range(depth):
+            entry = self.tt.probe(gs.zobristKey)
+            if entry is None:
+                break
+            move = None
+            for candidate in gs.getValidMoves():
+                if candidate.moveId == entry[3]:
+                    move = candidate
+                    break
+            if move is None:
+                break
+            pv.append(move)
+            gs.makeMove(move)
+        for move in pv:
+            gs.undoMove()
+        return pv
+
+
+def mvvLva(move):
+    if move.pieceCaptured == "--":
+        return 0
+    return 10 * ORDER_VALUES[move.pieceCaptured[1]] - ORDER_VALUES[move.pieceMoved[1]]
+
+
+def packedMvvLva(packed, squares):
+    captured = squares[(packed >> 6) & 63]
+    if captured == ChessBitboard.EMPTY:
+        if not packed & PACKED_ENPASSANT:
+            return 0
+        return 10 * ORDER_VALUES["P"] - ORDER_VALUES["P"]
+    return 10 * ORDER_VALUES_BY_CODE[captured] - ORDER_VALUES_BY_CODE[squares[packed & 63]]
+
+
+"""
+moveId of a packed move: start and end squares, plus the promotion piece as its index in Move.promotionPieces
+"""
+def packedMoveId(packed):
+    moveId = packed & 4095
+    if packed & PACKED_PROMOTION:
+        moveId |= ChessEngine.Move.promotionPieces.index(ChessEngine.Move.promotionNames[packed >> 15]) << 12
+    return moveId
+
+
+def scoreToTable(score, ply):
+    # mate scores are stored as distance from this node so they stay valid at other plies
+    if score >= MATE_THRESHOLD:
+        return score + ply
+    if score <= -MATE_THRESHOLD:
+        return score - ply
+    return score
+
+
+def scoreFromTable(score, ply):
+    if score >= MATE_THRESHOLD:
+        return score - ply
+    if score <= -MATE_THRESHOLD:
+        return score + ply
+    return score
+
+
+def findBestMove(gs, maxDepth=64, timeLimit=None, nodeLimit=None, tablebase=None):
+    return Searcher(tablebase=tablebase).search(gs, maxDepth, timeLimit, nodeLimit).bestMove
+
+
+"""
+Process target used by ChessMain: rebuilds the game from the starting position and the coordinate notation of every
+move played so far, plays from the Polyglot book at bookPath while the position is in it, otherwise searches, and puts
+(the chosen move's notation or None, stats) on returnQueue. With instrument the worker's own calls are counted and
+stats is their ChessInstrument snapshot, otherwise it is None.
+"""
+def searchWorker(stateClass, notations, maxDepth, timeLimit, returnQueue, bookPath=None, instrument=False):
+    if instrument:
+        import ChessInstrument # only loaded when asked for, it pulls in the bitboard backend and perft
+        ChessInstrument.enable()
+        ChessInstrument.reset()
+    gs = stateClass()
+    for notation in notations:
+        gs.makeMove(ChessEngine.moveFromNotation(gs, notation))
+    move = None
+    if bookPath is not None:
+        import ChessBook # only loaded when a book is used, so importing the search stays cheap
+        with ChessBook.OpeningBook(bookPath) as book:
+            move = book.chooseMove(gs)
+    if move is None:
+        move = findBestMove(gs, maxDepth, timeLimit)
+    stats = None
+    if instrument:
+        ChessInstrument.disable()
+        stats = ChessInstrument.snapshot()
+    returnQueue.put((move.getChessNotation() if move is not None else None, stats))
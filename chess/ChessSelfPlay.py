@@ -0,0 +1,195 @@
+"""
+Headless self-play: plays N games between two move selection policies across a process pool, writes every game to a
+JSON lines or PGN file as soon as it finishes (nothing is buffered in memory) and reports games/sec, average game
+length and the result distribution.
+
+A policy is any callable policy(gs, validMoves, rng) -> Move. Built-in ones are named in POLICIES, anything else is
+given as "module:function" and imported inside each worker.
+
+Usage:
+    python ChessSelfPlay.py --games 100 --white random --black greedy --processes 4 --output games.jsonl
+    python ChessSelfPlay.py --games 100 --format pgn --output games.pgn
+"""
+import argparse
+import importlib
+import json
+import random
+import sys
+import time
+from collections import Counter
+from multiprocessing import Pool
+
+import ChessEngine
+import ChessPGN
+import ChessPerft
+import ChessSearch
+
+CAPTURE_VALUES = {"P": 1, "N": 3, "B": 3, "R": 5, "Q": 9, "K": 0}
+
+
+def randomPolicy(gs, validMoves, rng):
+    return rng.choice(validMoves)
+
+
+"""
+Takes the most valuable capture (queen promotions count as captures of a queen), otherwise a random move
+"""
+def greedyCapturePolicy(gs, validMoves, rng):
+    best = []
+    bestValue = 0
+    for move in validMoves:
+        value = CAPTURE_VALUES[move.pieceCaptured[1]] if move.pieceCaptured != "--" else 0
+        if move.isPawnPromotion and move.promotionChoice == "Q":
+            value += CAPTURE_VALUES["Q"]
+        if value > bestValue:
+            best = [move]
+            bestValue = value
+        elif value == bestValue and value > 0:
+            best.append(move)
+    return rng.choice(best) if best else rng.choice(validMoves)
+
+
+def searchPolicy(gs, validMoves, rng):
+    return ChessSearch.Searcher().search(gs, maxDepth=2).bestMove
+
+
+POLICIES = {"random": randomPolicy, "greedy": greedyCapturePolicy, "search": searchPolicy}
+
+
+def resolvePolicy(name):
+    if name in POLICIES:
+        return POLICIES[name]
+    if ":" not in name:
+        raise ValueError("Unknown policy %s, use one of %s or module:function" % (name, ", ".join(sorted(POLICIES))))
+    moduleName, functionName = name.split(":", 1)
+    return getattr(importlib.import_module(moduleName), functionName)
+
+
+"""
+Plays one game and returns its record. Games end in mate, stalemate, threefold repetition or the fifty move rule;
+games that reach maxPlies are stopped unfinished with result "*". With withSan the record also gets the moves in SAN,
+which PGN output needs.
+"""
+def playGame(gameNumber, whiteName, blackName, seed, maxPlies=200, backend="mailbox", fen=ChessEngine.STARTING_FEN,
+             withSan=False):
+    rng = random.Random(seed)
+    policies = (resolvePolicy(whiteName), resolvePolicy(blackName))
+    gs = ChessPerft.BACKENDS[backend](fen)
+    notations = []
+    sanMoves = []
+    start = time.perf_counter()
+    validMoves = gs.getValidMoves()
+    while validMoves and len(notations) < maxPlies and gs.drawReason() is None:
+        move = policies[0 if gs.whiteToMove else 1](gs, validMoves, rng)
+        if withSan:
+            sanMoves.append(move.getSan(gs, validMoves))
+        gs.makeMove(move)
+        notations.append(move.getChessNotation())
+        validMoves = gs.getValidMoves()
+    if gs.checkMate:
+        result = "0-1" if gs.whiteToMove else "1-0"
+        termination = "checkmate"
+    elif gs.drawReason() is not None:
+        result = "1/2-1/2"
+        termination = gs.drawReason()
+    else:
+        result = "*"
+        termination = "max plies"
+    record = {"game": gameNumber, "white": whiteName, "black": blackName, "seed": seed, "fen": fen,
+              "result": result, "termination": termination, "plies": len(notations), "moves": notations,
+              "seconds": round(time.perf_counter() - start, 4)}
+    if withSan:
+        record["san"] = sanMoves
+    return record
+
+
+def recordToPgn(record):
+    headers = {"Event": "Self-play", "Round": record["game"] + 1, "White": record["white"], "Black": record["black"],
+               "Termination": record["termination"]}
+    blackStarts = False
+    fullmoveNumber = 1
+    if record["fen"] != ChessEngine.STARTING_FEN:
+        headers["SetUp"] = "1"
+        headers["FEN"] = record["fen"]
+        fields = record["fen"].split()
+        blackStarts = fields[1] == "b"
+        fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+    return ChessPGN.gameToPgn(headers, record["san"], record["result"], fullmoveNumber, blackStarts)
+
+
+def _playGameJob(args):
+    return playGame(*args)
+
+
+"""
+Runs the games on a pool and streams each finished record through writeRecord (by default one JSON line, or one PGN
+game when outputFormat is "pgn", to out). Records arrive in completion order. Returns the aggregate statistics as a
+dict.
+"""
+def runSelfPlay(games, white="random", black="random", processes=1, maxPlies=200, seed=0, backend="mailbox",
+                fen=ChessEngine.STARTING_FEN, out=None, writeRecord=None, outputFormat="jsonl"):
+    if writeRecord is None:
+        def writeRecord(record):
+            if out is not None:
+                out.write(recordToPgn(record) if outputFormat == "pgn" else json.dumps(record) + "\n")
+                out.flush()
+    withSan = outputFormat == "pgn"
+    jobs = ((i, white, black, seed + i, maxPlies, backend, fen, withSan) for i in range(games))
+    results = Counter()
+    terminations = Counter()
+    totalPlies = 0
+    start = time.perf_counter()
+    if processes > 1:
+        pool = Pool(processes)
+        records = pool.imap_unordered(_playGameJob, jobs)
+    else:
+        pool = None
+        records = map(_playGameJob, jobs)
+    try:
+        for record in records:
+            writeRecord(record)
+            results[record["result"]] += 1
+            terminations[record["termination"]] += 1
+            totalPlies += record["plies"]
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    seconds = time.perf_counter() - start
+    return {"games": games, "seconds": seconds, "gamesPerSecond": games / seconds if seconds > 0 else 0.0,
+            "averagePlies": totalPlies / games if games else 0.0, "plies": totalPlies,
+            "results": dict(results), "terminations": dict(terminations)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play games between move selection policies")
+    parser.add_argument("--games", type=int, default=10)
+    parser.add_argument("--white", default="random", help="policy name or module:function")
+    parser.add_argument("--black", default="random", help="policy name or module:function")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--max-plies", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0, help="game i is played with seed + i")
+    parser.add_argument("--backend", choices=sorted(ChessPerft.BACKENDS), default="mailbox")
+    parser.add_argument("--fen", default=ChessEngine.STARTING_FEN, help="starting position of every game")
+    parser.add_argument("--output", help="file to stream games to (default: no game output)")
+    parser.add_argument("--format", choices=("jsonl", "pgn"), default="jsonl", help="format of --output")
+    args = parser.parse_args(argv)
+
+    out = open(args.output, "w") if args.output else None
+    try:
+        stats = runSelfPlay(args.games, args.white, args.black, args.processes, args.max_plies, args.seed,
+                            args.backend, args.fen, out, outputFormat=args.format)
+    finally:
+        if out is not None:
+            out.close()
+    print("%d games in %.2fs (%.2f games/sec), %.1f plies on average" %
+          (stats["games"], stats["seconds"], stats["gamesPerSecond"], stats["averagePlies"]))
+    for result, count in sorted(stats["results"].items()):
+        print("%-8s %d" % (result, count))
+    for termination, count in sorted(stats["terminations"].items()):
+        print("%-10s %d" % (termination, count))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
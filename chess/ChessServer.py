@@ -0,0 +1,330 @@
+"""
+Asyncio game server speaking JSON lines over local TCP, for hosting many games at once without the pygame window.
+Every request is one JSON object on one line and gets one JSON object back carrying the same "id". Requests from one
+connection are handled concurrently, so replies may come back out of order and clients match them by id.
+
+Requests:
+    {"id": 1, "op": "new", "fen": "..."}            fen is optional, the standard start by default
+    {"id": 2, "op": "move", "game": 7, "move": "e2e4"}
+    {"id": 3, "op": "state", "game": 7}
+    {"id": 4, "op": "history", "game": 7}
+    {"id": 5, "op": "close", "game": 7}
+    {"id": 6, "op": "stats"}
+new, move and state reply with the game id, fen, side to move, legal moves, status (ongoing, checkmate, stalemate,
+threefold repetition or fifty-move rule) and result. Failures reply {"id": ..., "ok": false, "error": "..."}.
+Games belong to the connection that created them and are closed when it disconnects, so abandoned games never pile up.
+
+A session is kept as a compact snapshot instead of a GameState: the current FEN, the zobrist keys of the positions
+since the last capture or pawn move (all that repetition needs) and the played moves as packed integers. Move
+generation runs in a process pool on a BitboardGameState rebuilt from that snapshot, so the event loop only parses,
+dispatches and writes. At most one batch of jobs per worker is in the pool at a time and jobs arriving meanwhile are
+queued, then sent together (up to MAX_BATCH per submission) as batches come back, so under load the cost of a pool
+round trip is shared by many requests.
+
+Usage:
+    python ChessServer.py --port 8765 --processes 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import ChessBitboard
+import ChessEngine
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_MAX_SESSIONS = 100000
+MAX_PIPELINE = 256 # requests of one connection in flight at once
+MAX_LINE = 1 << 16
+MAX_BATCH = 64 # pool jobs per submission
+
+
+class Session():
+    __slots__ = ("startFen", "fen", "keys", "moves")
+
+    def __init__(self, fen):
+        self.startFen = fen
+        self.fen = fen
+        self.keys = array("Q") # positions since the last irreversible move, oldest first, the current one excluded
+        self.moves = array("I") # packed moves from startFen
+
+
+def packedNotation(packed):
+    start = packed & 63
+    end = (packed >> 6) & 63
+    notation = ChessEngine.Move.colsToFiles[start & 7] + ChessEngine.Move.rowsToRanks[start >> 3] + \
+               ChessEngine.Move.colsToFiles[end & 7] + ChessEngine.Move.rowsToRanks[end >> 3]
+    if (packed >> 12) & ChessEngine.Move.FLAG_PROMOTION:
+        notation += ChessEngine.Move.promotionNames[packed >> 15].lower()
+    return notation
+
+
+"""
+Worker side: the position of a snapshot, with the repetition history seeded from keys
+"""
+def loadPosition(fen, keys):
+    gs = ChessBitboard.BitboardGameState(fen)
+    for key in keys:
+        gs.positionCounts[key] = gs.positionCounts.get(key, 0) + 1
+    return gs
+
+
+"""
+Worker side: status and legal move notations of gs, legal being its packed legal moves
+"""
+def describePosition(gs, legal):
+    if gs.checkMate:
+        status = "checkmate"
+        result = "0-1" if gs.whiteToMove else "1-0"
+    else:
+        status = gs.drawReason() or "ongoing"
+        result = "*" if status == "ongoing" else "1/2-1/2"
+    return {"fen": gs.getFen(), "turn": "w" if gs.whiteToMove else "b", "status": status, "result": result,
+            "legal": [] if status != "ongoing" else [packedNotation(packed) for packed in legal]}
+
+
+def positionState(fen, keys):
+    gs = loadPosition(fen, keys)
+    return describePosition(gs, gs.getValidPackedMoves())
+
+
+"""
+Worker side: plays notation on the snapshot and returns (packed move, key before the move, whether the move was
+irreversible, description of the new position)
+"""
+def playMove(fen, keys, notation):
+    gs = loadPosition(fen, keys)
+    legal = gs.getValidPackedMoves()
+    if gs.checkMate or gs.drawReason() is not None:
+        raise ValueError("game is over: " + (gs.drawReason() or "checkmate"))
+    for packed in legal:
+        if packedNotation(packed) == notation:
+            break
+    else:
+        raise ValueError("Illegal move " + notation)
+    keyBefore = gs.zobristKey
+    gs.makeMove(ChessEngine.Move.fromPacked(packed, gs.board)) # through movelog, so the FEN move number advances
+    return packed, keyBefore, gs.halfmoveClockLog[-1] == 0, describePosition(gs, gs.getValidPackedMoves())
+
+
+"""
+Worker side: runs (function, args) jobs, returning (True, result) or (False, error message) for each
+"""
+def runBatch(jobs):
+    results = []
+    for function, args in jobs:
+        try:
+            results.append((True, function(*args)))
+        except Exception as e: # one bad job must not fail the others of its batch
+            results.append((False, str(e) if isinstance(e, ValueError) else "%s: %s" % (type(e).__name__, e)))
+    return results
+
+
+class GameServer():
+    def __init__(self, processes=None, maxSessions=DEFAULT_MAX_SESSIONS):
+        self.processes = processes or os.cpu_count() or 1
+        self.pool = ProcessPoolExecutor(self.processes)
+        self.maxSessions = maxSessions
+        self.sessions = {}
+        self.batch = [] # (function, args, future) waiting for a free worker
+        self.inFlight = 0 # batches submitted and not yet settled
+        self.flushScheduled = False
+        self.nextGame = 1
+        self.requests = 0
+        self.connections = 0
+        self.started = time.perf_counter()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, ready=None):
+        server = await asyncio.start_server(self.handleConnection, host, port, limit=MAX_LINE)
+        if ready is not None:
+            ready(server)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.pool.shutdown()
+
+    """
+    Queues function(*args) for the pool and returns a future of its result
+    """
+    def dispatch(self, function, *args):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.batch.append((function, args, future))
+        if self.inFlight < self.processes and not self.flushScheduled:
+            self.flushScheduled = True # sent at the end of this pass, with whatever else arrives in it
+            loop.call_soon(self.flush)
+        return future
+
+    def flush(self):
+        self.flushScheduled = False
+        while self.batch and self.inFlight < self.processes:
+            batch = self.batch[:MAX_BATCH]
+            del self.batch[:MAX_BATCH]
+            jobs = [(function, args) for function, args, future in batch]
+            try:
+                submitted = asyncio.wrap_future(self.pool.submit(runBatch, jobs))
+            except Exception as e: # e.g. BrokenProcessPool after a worker died, the requests still get their replies
+                for function, args, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.inFlight += 1
+            submitted.add_done_callback(lambda done, batch=batch: self.settle(batch, done))
+
+    def settle(self, batch, done):
+        self.inFlight -= 1
+        self.flush()
+        if done.exception() is not None:
+            for function, args, future in batch:
+                if not future.done():
+                    future.set_exception(done.exception())
+            return
+        for (function, args, future), (ok, value) in zip(batch, done.result()):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(ValueError(value))
+
+    async def handleConnection(self, reader, writer):
+        self.connections += 1
+        pipeline = asyncio.Semaphore(MAX_PIPELINE)
+        pending = set()
+        owned = set() # games created on this connection
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ConnectionError, ValueError): # reset, or a line over MAX_LINE
+                    break
+                if not line:
+                    break
+                await pipeline.acquire()
+                task = asyncio.ensure_future(self.respond(line, writer, pipeline, owned))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.wait(pending)
+        finally:
+            self.connections -= 1
+            for game in owned:
+                self.sessions.pop(game, None)
+            writer.close()
+
+    """
+    Handles one request line and writes its reply; every failure, whatever its type, becomes an ok false reply
+    """
+    async def respond(self, line, writer, pipeline, owned):
+        try:
+            requestId = None
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("request must be a JSON object")
+                requestId = request.get("id")
+                reply = await self.handle(request, owned)
+                reply["ok"] = True
+            except (ValueError, TypeError) as e:
+                reply = {"ok": False, "error": str(e)}
+            except Exception as e:
+                reply = {"ok": False, "error": "%s: %s" % (type(e).__name__, e)}
+            reply["id"] = requestId
+            if not writer.is_closing():
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            pipeline.release()
+
+    def session(self, request):
+        game = request.get("game")
+        if game not in self.sessions:
+            raise ValueError("unknown game %s" % game)
+        return game, self.sessions[game]
+
+    async def handle(self, request, owned):
+        self.requests += 1
+        op = request.get("op")
+        if op == "new":
+            if len(self.sessions) >= self.maxSessions:
+                raise ValueError("session limit of %d reached" % self.maxSessions)
+            fen = request.get("fen") or ChessEngine.STARTING_FEN
+            if not isinstance(fen, str):
+                raise ValueError("fen must be a string")
+            ChessEngine.parseFen(fen) # cheap, so a bad FEN gets its plain ValueError before any pool work
+            state = await self.dispatch(positionState, fen, ())
+            game = self.nextGame
+            self.nextGame += 1
+            session = Session(fen)
+            session.fen = state["fen"]
+            self.sessions[game] = session
+            owned.add(game)
+            state["game"] = game
+            return state
+        elif op == "move":
+            game, session = self.session(request)
+            ply = len(session.moves)
+            if "move" not in request:
+                raise ValueError("move missing")
+            packed, keyBefore, irreversible, state = await self.dispatch(playMove, session.fen, session.keys,
+                                                                         str(request["move"]))
+            if self.sessions.get(game) is not session or len(session.moves) != ply:
+                raise ValueError("game %d changed while the move was checked, retry" % game)
+            session.moves.append(packed)
+            if irreversible:
+                session.keys = array("Q")
+            else:
+                session.keys.append(keyBefore)
+            session.fen = state["fen"]
+            state["game"] = game
+            state["played"] = packedNotation(packed)
+            return state
+        elif op == "state":
+            game, session = self.session(request)
+            state = await self.dispatch(positionState, session.fen, session.keys)
+            state["game"] = game
+            return state
+        elif op == "history":
+            game, session = self.session(request)
+            return {"game": game, "startFen": session.startFen, "fen": session.fen,
+                    "moves": [packedNotation(packed) for packed in session.moves]}
+        elif op == "close":
+            game, session = self.session(request)
+            del self.sessions[game]
+            owned.discard(game)
+            return {"game": game}
+        elif op == "stats":
+            return {"sessions": len(self.sessions), "connections": self.connections, "requests": self.requests,
+                    "uptime": time.perf_counter() - self.started}
+        raise ValueError("unknown op %s" % op)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve chess games over JSON lines on TCP")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--processes", type=int, default=None, help="move generation workers (default: cpu count)")
+    parser.add_argument("--max-sessions", type=int, default=DEFAULT_MAX_SESSIONS)
+    args = parser.parse_args(argv)
+
+    server = GameServer(args.processes, args.max_sessions)
+    try:
+        asyncio.run(server.serve(args.host, args.port,
+                                 lambda s: print("listening on %s:%d" % (args.host, args.port), flush=True)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
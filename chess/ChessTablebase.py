@@ -0,0 +1,581 @@
+"""
+Distance to mate endgame tablebases for a lone king against a few pieces (KQK, KRK, KPK, KBNK, KBBK), generated by
+retrograde analysis and probed through mmap.
+
+Tables are always built with white as the strong side; positions with black as the strong side are probed
+colour-flipped. The strong king is reduced by symmetry to the a1-d1-d4 triangle (pawnless tables, 10 squares) or to
+files a-d (pawn tables, 32 squares), and every other piece gets a plain 0-63 square, so a position's entry is found by
+arithmetic alone. Each entry is one byte: 0 is a draw, 255 an illegal or non-canonical position, anything else is the
+distance to mate in plies plus one. An odd distance means the side to move mates, an even one that it gets mated.
+Castling rights and the fifty move rule are ignored.
+
+Generation spreads both the initial scan and every retrograde round over a process pool. The verify command replays
+positions through GameState.getValidMoves and checks every entry is consistent with the entries of its children.
+
+Usage:
+    python ChessTablebase.py generate KQK KRK KPK KBNK --processes 4
+    python ChessTablebase.py verify KPK --samples 20000 --processes 4
+    python ChessTablebase.py probe --fen "8/8/8/4k3/8/8/8/4K2Q w - - 0 1"
+"""
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+import time
+from array import array
+from multiprocessing import Pool
+
+import ChessEngine
+from ChessBitboard import KING_ATTACKS, KNIGHT_ATTACKS, PAWN_ATTACKS, WHITE, bishopAttacks, rookAttacks
+
+MATERIALS = ("KQK", "KRK", "KPK", "KBNK", "KBBK")
+MAX_PIECES = max(len(material) for material in MATERIALS)
+PIECE_ORDER = "QRBNP" # order of the strong side's pieces in a material name
+DRAW = 0
+INVALID = 255
+NEVER = 255 # move counter of a weak side position that can never be lost
+MAX_DTM = 253
+MAGIC = b"CTB1"
+HEADER = struct.Struct("<4s8sI") # magic, material, entries per side to move
+CHUNK = 1 << 14 # positions per pool job
+
+# the 8 board symmetries as square maps; the first two (identity, file mirror) are the only ones valid with pawns
+SYMMETRIES = []
+for _transpose in (False, True):
+    for _flipRank in (False, True):
+        for _flipFile in (False, True):
+            _table = []
+            for _sq in range(64):
+                _r, _c = divmod(_sq, 8)
+                if _transpose:
+                    _r, _c = _c, _r
+                if _flipRank:
+                    _r = 7 - _r
+                if _flipFile:
+                    _c = 7 - _c
+                _table.append(_r * 8 + _c)
+            SYMMETRIES.append(tuple(_table))
+PAWN_KING_SQUARES = [sq for sq in range(64) if sq % 8 < 4]
+PAWNLESS_KING_SQUARES = [sq for sq in range(64) if sq % 8 < 4 and sq // 8 >= 4 and sq % 8 >= 7 - sq // 8]
+
+
+def pieceAttacks(pieceType, sq, occupied):
+    if pieceType == "N":
+        return KNIGHT_ATTACKS[sq]
+    if pieceType == "B":
+        return bishopAttacks(sq, occupied)
+    if pieceType == "R":
+        return rookAttacks(sq, occupied)
+    if pieceType == "Q":
+        return rookAttacks(sq, occupied) | bishopAttacks(sq, occupied)
+    return PAWN_ATTACKS[WHITE][sq]
+
+
+def strongAttacks(pieceTypes, strongKing, pieces, occupied):
+    attacks = KING_ATTACKS[strongKing]
+    for pieceType, sq in zip(pieceTypes, pieces):
+        attacks |= pieceAttacks(pieceType, sq, occupied)
+    return attacks
+
+
+def bitSquares(bitboard):
+    while bitboard:
+        bit = bitboard & -bitboard
+        yield bit.bit_length() - 1
+        bitboard ^= bit
+
+
+def materialName(pieceTypes):
+    return "K" + "".join(sorted(pieceTypes, key=PIECE_ORDER.index)) + "K"
+
+
+"""
+Index arithmetic of one material set. A position is (strong king, weak king, [strong pieces in material order]) with
+squares numbered r*8+c like the bitboard backend.
+"""
+class TablebaseLayout():
+    def __init__(self, material):
+        if material not in MATERIALS:
+            raise ValueError("Unsupported material %s, use one of %s" % (material, ", ".join(MATERIALS)))
+        self.material = material
+        self.pieceTypes = material[1:-1]
+        self.hasPawns = "P" in self.pieceTypes
+        self.kingSquares = PAWN_KING_SQUARES if self.hasPawns else PAWNLESS_KING_SQUARES
+        self.kingSlots = {sq: i for i, sq in enumerate(self.kingSquares)}
+        transforms = SYMMETRIES[:2] if self.hasPawns else SYMMETRIES
+        self.kingTransforms = [[t for t in transforms if t[sq] in self.kingSlots] for sq in range(64)]
+        self.size = len(self.kingSquares) << (6 * (len(self.pieceTypes) + 1))
+        # (piece, table) reached by promoting a pawn, tables which have to exist before this one is generated
+        self.promotions = []
+        if self.hasPawns:
+            for promotion in "QR":
+                name = materialName(self.pieceTypes.replace("P", promotion, 1))
+                if name in MATERIALS:
+                    self.promotions.append((promotion, name))
+        self.dependencies = [name for promotion, name in self.promotions]
+
+    """
+    Index of the position under the symmetry that puts the strong king in its reduced area; when two symmetries do
+    (king on the diagonal) the smaller index is the canonical one
+    """
+    def canonicalIndex(self, strongKing, weakKing, pieces):
+        best = -1
+        for t in self.kingTransforms[strongKing]:
+            index = self.kingSlots[t[strongKing]] << 6 | t[weakKing]
+            for sq in pieces:
+                index = index << 6 | t[sq]
+            if best < 0 or index < best:
+                best = index
+        return best
+
+    def decode(self, index):
+        pieces = []
+        for i in range(len(self.pieceTypes)):
+            pieces.append(index & 63)
+            index >>= 6
+        pieces.reverse()
+        return self.kingSquares[index >> 6], index & 63, pieces
+
+    """
+    Bitboard of all pieces, or 0 when squares overlap, pawns stand on the first or last rank or the kings touch
+    """
+    def occupancy(self, strongKing, weakKing, pieces):
+        if strongKing == weakKing or KING_ATTACKS[strongKing] >> weakKing & 1:
+            return 0
+        occupied = 1 << strongKing | 1 << weakKing
+        for pieceType, sq in zip(self.pieceTypes, pieces):
+            bit = 1 << sq
+            if occupied & bit or (pieceType == "P" and (sq < 8 or sq >= 56)):
+                return 0
+            occupied |= bit
+        return occupied
+
+
+def tablePath(directory, material):
+    return os.path.join(directory, material + ".ctb")
+
+
+"""
+Read-only access to the table files of a directory. Files are mapped on first use; a Tablebase pickles as its
+directory so pool workers map the same page cached files.
+"""
+class Tablebase():
+    def __init__(self, directory="tablebases"):
+        self.directory = directory
+        self.tables = {}
+
+    def __getstate__(self):
+        return {"directory": self.directory}
+
+    def __setstate__(self, state):
+        self.__init__(state["directory"])
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table[1].close()
+                table[2].close()
+        self.tables = {}
+
+    def table(self, material):
+        if material not in self.tables:
+            path = tablePath(self.directory, material)
+            if material not in MATERIALS or not os.path.exists(path):
+                self.tables[material] = None
+            else:
+                handle = open(path, "rb")
+                data = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, name, size = HEADER.unpack_from(data, 0)
+                if magic != MAGIC or name.rstrip(b"\0").decode() != material:
+                    data.close()
+                    handle.close()
+                    raise ValueError("%s is not a %s table" % (path, material))
+                self.tables[material] = (TablebaseLayout(material), data, handle)
+        return self.tables[material]
+
+    def canProbe(self, gs):
+        return pieceCount(gs) <= MAX_PIECES
+
+    """
+    Raw entry of a position given as squares with white as the strong side, None if the table is missing
+    """
+    def probeSquares(self, material, strongKing, weakKing, pieces, strongToMove):
+        table = self.table(material)
+        if table is None:
+            return None
+        layout, data, handle = table
+        index = layout.canonicalIndex(strongKing, weakKing, pieces)
+        return data[HEADER.size + (0 if strongToMove else layout.size) + index]
+
+    """
+    (wdl, dtm) of a GameState from the side to move's point of view: wdl is 1, 0 or -1 and dtm the plies to mate
+    (None for draws). Returns None when the material has no table or the position still has castling rights.
+    """
+    def probe(self, gs):
+        if gs.currentCastlingRight.index() != 0:
+            return None
+        white = []
+        black = []
+        for r, row in enumerate(gs.board):
+            for c, piece in enumerate(row):
+                if piece != "--":
+                    (white if piece[0] == "w" else black).append((piece[1], r * 8 + c))
+        if len(black) == 1:
+            strong, weak, flip = white, black, 0
+        elif len(white) == 1:
+            strong, weak, flip = black, white, 56 # mirror the ranks so the strong side plays up the board as white
+        else:
+            return None
+        strong.sort(key=lambda entry: -1 if entry[0] == "K" else PIECE_ORDER.index(entry[0]))
+        if len(strong) + 1 > MAX_PIECES or strong[0][0] != "K":
+            return None
+        material = materialName([pieceType for pieceType, sq in strong[1:]])
+        if material not in MATERIALS:
+            return None
+        strongToMove = gs.whiteToMove != bool(flip)
+        value = self.probeSquares(material, strong[0][1] ^ flip, weak[0][1] ^ flip, [sq ^ flip for pieceType, sq in strong[1:]], strongToMove)
+        return decodeValue(value)
+
+
+def decodeValue(value):
+    if value is None or value == INVALID:
+        return None
+    if value == DRAW:
+        return 0, None
+    dtm = value - 1
+    return (1 if dtm % 2 else -1), dtm
+
+
+"""
+Number of pieces on the board, cheap enough to gate tablebase probes in the search
+"""
+def pieceCount(gs):
+    pieces = getattr(gs, "pieces", None)
+    if pieces is not None:
+        return sum(bin(bitboard).count("1") for bitboard in pieces)
+    return sum(len(squares) for squares in gs.pieceSquares.values())
+
+
+# state of a generation or verification worker, set by _initWorker
+_worker = {}
+
+
+def _initWorker(material, directory):
+    _worker["layout"] = TablebaseLayout(material)
+    _worker["tablebase"] = Tablebase(directory)
+
+
+"""
+Best promotion of a strong side to move position: the shortest win reached by promoting, as the position's distance
+to mate, or 0 when no promotion wins
+"""
+def promotionSeed(layout, tablebase, strongKing, weakKing, pieces, occupied):
+    best = 0
+    for j, (pieceType, sq) in enumerate(zip(layout.pieceTypes, pieces)):
+        if pieceType != "P" or sq >= 16 or occupied >> (sq - 8) & 1:
+            continue
+        for promotion, material in layout.promotions:
+            promoted = pieces[:j] + [sq - 8] + pieces[j + 1:]
+            # the promoted piece takes its place in the material order of the new table
+            promotedTypes = layout.pieceTypes[:j] + promotion + layout.pieceTypes[j + 1:]
+            order = sorted(range(len(promoted)), key=lambda i: PIECE_ORDER.index(promotedTypes[i]))
+            result = decodeValue(tablebase.probeSquares(material, strongKing, weakKing, [promoted[i] for i in order], False))
+            if result is not None and result[0] < 0 and (best == 0 or result[1] + 1 < best):
+                best = result[1] + 1
+    return best
+
+
+"""
+Scans positions [start, end): marks illegal and non-canonical ones, finds the weak side's checkmates, counts the
+distinct positions every weak side move leads to and seeds strong side wins by promotion
+"""
+def _scanRange(bounds):
+    layout = _worker["layout"]
+    tablebase = _worker["tablebase"]
+    start, end = bounds
+    strong = bytearray(end - start)
+    weak = bytearray(end - start)
+    counters = bytearray(end - start)
+    mates = array("I")
+    seeds = []
+    for index in range(start, end):
+        i = index - start
+        strongKing, weakKing, pieces = layout.decode(index)
+        occupied = layout.occupancy(strongKing, weakKing, pieces)
+        if not occupied or layout.canonicalIndex(strongKing, weakKing, pieces) != index:
+            strong[i] = weak[i] = INVALID
+            continue
+        attacks = strongAttacks(layout.pieceTypes, strongKing, pieces, occupied ^ (1 << weakKing))
+        inCheck = attacks >> weakKing & 1
+        if inCheck:
+            strong[i] = INVALID # the weak king cannot be in check with the strong side to move
+        elif layout.promotions:
+            seed = promotionSeed(layout, tablebase, strongKing, weakKing, pieces, occupied)
+            if seed:
+                seeds.append((seed, index))
+        children = set()
+        canDraw = False
+        for target in bitSquares(KING_ATTACKS[weakKing] & ~attacks):
+            if occupied >> target & 1:
+                canDraw = True # an undefended piece can be taken, which leaves too little material to mate
+                break
+            children.add(layout.canonicalIndex(strongKing, target, pieces))
+        if canDraw:
+            counters[i] = NEVER
+        elif children:
+            counters[i] = len(children)
+        elif inCheck:
+            weak[i] = 1
+            mates.append(index)
+        else:
+            counters[i] = NEVER # stalemate
+    return start, strong, weak, counters, mates, seeds
+
+
+"""
+Strong side to move positions with a move into one of the given weak side to move positions
+"""
+def _strongPredecessors(indices):
+    layout = _worker["layout"]
+    pieceTypes = layout.pieceTypes
+    result = array("I")
+    for index in indices:
+        strongKing, weakKing, pieces = layout.decode(index)
+        occupied = layout.occupancy(strongKing, weakKing, pieces)
+        predecessors = set()
+        for origin in bitSquares(KING_ATTACKS[strongKing] & ~occupied & ~KING_ATTACKS[weakKing]):
+            if not strongAttacks(pieceTypes, origin, pieces, occupied ^ (1 << strongKing) | (1 << origin)) >> weakKing & 1:
+                predecessors.add(layout.canonicalIndex(origin, weakKing, pieces))
+        for j, (pieceType, sq) in enumerate(zip(pieceTypes, pieces)):
+            if pieceType == "P":
+                origins = 0
+                if sq < 48 and not occupied >> (sq + 8) & 1:
+                    origins = 1 << (sq + 8)
+                    if 32 <= sq < 40 and not occupied >> (sq + 16) & 1:
+                        origins |= 1 << (sq + 16)
+            else:
+                origins = pieceAttacks(pieceType, sq, occupied) & ~occupied
+            for origin in bitSquares(origins):
+                moved = pieces[:j] + [origin] + pieces[j + 1:]
+                if not strongAttacks(pieceTypes, strongKing, moved, occupied ^ (1 << sq) | (1 << origin)) >> weakKing & 1:
+                    predecessors.add(layout.canonicalIndex(strongKing, weakKing, moved))
+        result.extend(predecessors)
+    return result
+
+
+"""
+Weak side to move positions with a king move into one of the given strong side to move positions, once per distinct
+pair so they line up with the child counts of _scanRange
+"""
+def _weakPredecessors(indices):
+    layout = _worker["layout"]
+    result = array("I")
+    for index in indices:
+        strongKing, weakKing, pieces = layout.decode(index)
+        occupied = layout.occupancy(strongKing, weakKing, pieces)
+        predecessors = set()
+        for origin in bitSquares(KING_ATTACKS[weakKing] & ~occupied & ~KING_ATTACKS[strongKing]):
+            predecessors.add(layout.canonicalIndex(strongKing, origin, pieces))
+        result.extend(predecessors)
+    return result
+
+
+def _chunks(indices, size=CHUNK):
+    return [indices[i:i + size] for i in range(0, len(indices), size)]
+
+
+"""
+Generates the table of material into directory (and the tables it promotes into, if missing). Returns the path.
+"""
+def generate(material, directory="tablebases", processes=1, out=sys.stdout):
+    layout = TablebaseLayout(material)
+    os.makedirs(directory, exist_ok=True)
+    for dependency in layout.dependencies:
+        if not os.path.exists(tablePath(directory, dependency)):
+            generate(dependency, directory, processes, out)
+    start = time.perf_counter()
+    if processes > 1:
+        pool = Pool(processes, initializer=_initWorker, initargs=(material, directory))
+        mapper = pool.imap
+    else:
+        pool = None
+        _initWorker(material, directory)
+        mapper = map
+    try:
+        strong = bytearray(layout.size)
+        weak = bytearray(layout.size)
+        counters = bytearray(layout.size)
+        frontier = array("I")
+        seeds = {}
+        ranges = [(i, min(i + CHUNK, layout.size)) for i in range(0, layout.size, CHUNK)]
+        for first, strongPart, weakPart, counterPart, mates, seedPart in mapper(_scanRange, ranges):
+            strong[first:first + len(strongPart)] = strongPart
+            weak[first:first + len(weakPart)] = weakPart
+            counters[first:first + len(counterPart)] = counterPart
+            frontier.extend(mates)
+            for dtm, index in seedPart:
+                seeds.setdefault(dtm, array("I")).append(index)
+        out.write("%s: %d positions per side, %d mates, scanned in %.1fs\n" % (material, layout.size, len(frontier), time.perf_counter() - start))
+
+        dtm = 1
+        longest = 0
+        while frontier or any(d >= dtm for d in seeds):
+            if dtm > MAX_DTM:
+                raise ValueError("%s has mates longer than %d plies" % (material, MAX_DTM))
+            resolved = array("I")
+            if dtm % 2: # strong side to move: won as soon as one move reaches a lost weak side position
+                for predecessors in mapper(_strongPredecessors, _chunks(frontier)):
+                    for index in predecessors:
+                        if strong[index] == DRAW:
+                            strong[index] = dtm + 1
+                            resolved.append(index)
+                for index in seeds.pop(dtm, ()):
+                    if strong[index] == DRAW:
+                        strong[index] = dtm + 1
+                        resolved.append(index)
+            else: # weak side to move: lost once every move reaches a won strong side position
+                for predecessors in mapper(_weakPredecessors, _chunks(frontier)):
+                    for index in predecessors:
+                        if weak[index] == DRAW and counters[index] != NEVER:
+                            counters[index] -= 1
+                            if counters[index] == 0:
+                                weak[index] = dtm + 1
+                                resolved.append(index)
+            if resolved:
+                longest = dtm
+            frontier = resolved
+            dtm += 1
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    path = tablePath(directory, material)
+    with open(path + ".tmp", "wb") as handle:
+        handle.write(HEADER.pack(MAGIC, material.encode(), layout.size))
+        handle.write(strong)
+        handle.write(weak)
+    os.replace(path + ".tmp", path)
+    wins = sum(1 for value in strong if value != DRAW and value != INVALID)
+    out.write("%s: %d strong side wins, longest mate %d plies, %.1fs total -> %s\n" %
+              (material, wins, longest, time.perf_counter() - start, path))
+    return path
+
+
+def squaresToFen(layout, strongKing, weakKing, pieces, strongToMove):
+    board = [["1"] * 8 for r in range(8)]
+    board[strongKing // 8][strongKing % 8] = "K"
+    board[weakKing // 8][weakKing % 8] = "k"
+    for pieceType, sq in zip(layout.pieceTypes, pieces):
+        board[sq // 8][sq % 8] = pieceType
+    rows = []
+    for row in board:
+        text = ""
+        empty = 0
+        for square in row:
+            if square == "1":
+                empty += 1
+            else:
+                text += (str(empty) if empty else "") + square
+                empty = 0
+        rows.append(text + (str(empty) if empty else ""))
+    return "/".join(rows) + (" w" if strongToMove else " b") + " - - 0 1"
+
+
+"""
+Checks entries against GameState: the value of every position must follow from the values of the positions its legal
+moves lead to (captures and minor promotions, which leave no table, are draws). Returns the list of mismatches.
+"""
+def _verifyIndices(indices):
+    layout = _worker["layout"]
+    tablebase = _worker["tablebase"]
+    errors = []
+    for index, strongToMove in indices:
+        strongKing, weakKing, pieces = layout.decode(index)
+        stored = decodeValue(tablebase.probeSquares(layout.material, strongKing, weakKing, pieces, strongToMove))
+        if stored is None:
+            continue
+        fen = squaresToFen(layout, strongKing, weakKing, pieces, strongToMove)
+        gs = ChessEngine.GameState(fen)
+        moves = gs.getValidMoves()
+        if not moves:
+            expected = (-1, 0) if gs.checkMate else (0, None)
+        else:
+            children = []
+            for move in moves:
+                gs.makeMove(move)
+                children.append(tablebase.probe(gs) or (0, None))
+                gs.undoMove()
+            losses = [dtm for wdl, dtm in children if wdl < 0]
+            if losses:
+                expected = (1, min(losses) + 1)
+            elif all(wdl > 0 for wdl, dtm in children):
+                expected = (-1, max(dtm for wdl, dtm in children) + 1)
+            else:
+                expected = (0, None)
+        if stored != expected:
+            errors.append((fen, stored, expected))
+    return errors
+
+
+def verify(material, directory="tablebases", samples=None, processes=1, seed=0):
+    layout = TablebaseLayout(material)
+    if samples is None:
+        jobs = [(index, side) for index in range(layout.size) for side in (True, False)]
+    else:
+        rng = random.Random(seed)
+        jobs = [(rng.randrange(layout.size), rng.random() < 0.5) for i in range(samples)]
+    chunks = _chunks(jobs, 1024)
+    if processes > 1:
+        with Pool(processes, initializer=_initWorker, initargs=(material, directory)) as pool:
+            results = pool.map(_verifyIndices, chunks)
+    else:
+        _initWorker(material, directory)
+        results = [_verifyIndices(chunk) for chunk in chunks]
+    return [error for result in results for error in result]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate, verify and probe endgame tablebases")
+    parser.add_argument("--dir", default="tablebases", help="directory holding the table files")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generateParser = commands.add_parser("generate")
+    generateParser.add_argument("materials", nargs="+", choices=MATERIALS)
+    generateParser.add_argument("--processes", type=int, default=1)
+    verifyParser = commands.add_parser("verify")
+    verifyParser.add_argument("materials", nargs="+", choices=MATERIALS)
+    verifyParser.add_argument("--samples", type=int, help="random positions to check (default: every position)")
+    verifyParser.add_argument("--processes", type=int, default=1)
+    verifyParser.add_argument("--seed", type=int, default=0)
+    probeParser = commands.add_parser("probe")
+    probeParser.add_argument("--fen", required=True)
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        for material in args.materials:
+            generate(material, args.dir, args.processes)
+        return 0
+    if args.command == "verify":
+        failed = False
+        for material in args.materials:
+            start = time.perf_counter()
+            errors = verify(material, args.dir, args.samples, args.processes, args.seed)
+            for fen, stored, expected in errors[:20]:
+                print("%s: table %s, children give %s" % (fen, stored, expected))
+            print("%s: %d mismatches in %.1fs" % (material, len(errors), time.perf_counter() - start))
+            failed = failed or bool(errors)
+        return 1 if failed else 0
+    result = Tablebase(args.dir).probe(ChessEngine.GameState(args.fen))
+    if result is None:
+        print("not in the tablebases")
+    elif result[0] == 0:
+        print("draw")
+    else:
+        print("%s in %d plies" % ("win" if result[0] > 0 else "loss", result[1]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
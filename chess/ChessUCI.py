@@ -0,0 +1,276 @@
+"""
+Headless UCI front-end, so the engine can be driven by GUIs and tournament managers. Standard input is read on its own
+thread and commands are handled as they arrive, while searches and perft run on a worker thread, so stop and isready
+are answered at once even in the middle of a search. Only the move generator, evaluation and search are imported at
+startup (no pygame); the bitboard backend, opening book and tablebases are loaded when an option asks for them.
+
+Supported: uci, isready, ucinewgame, setoption (Hash, Backend, BookFile, TablebasePath), position startpos|fen ...
+[moves ...], go [depth|movetime|nodes|wtime/btime/winc/binc/movestogo|infinite|perft N], stop, quit, and d to print
+the current FEN.
+
+Usage:
+    python ChessUCI.py
+"""
+import queue
+import sys
+import threading
+import time
+
+import ChessEngine
+import ChessSearch
+
+ENGINE_NAME = "Chess"
+ENGINE_AUTHOR = "demonsorca"
+DEFAULT_HASH_MB = 16
+MOVE_OVERHEAD = 0.05 # seconds kept back per move for communication
+DEFAULT_MOVES_TO_GO = 30
+
+
+def _readLines(lines, source):
+    for line in source:
+        lines.put(line)
+    lines.put(None) # end of input
+
+
+class UciEngine():
+    def __init__(self, out=sys.stdout):
+        self.out = out
+        self.outputLock = threading.Lock()
+        self.backend = "mailbox"
+        self.hashMB = DEFAULT_HASH_MB
+        self.book = None
+        self.tablebase = None
+        self.searcher = ChessSearch.Searcher(ChessEngine.TranspositionTable(self.hashMB, entryBytes=128))
+        self.gs = self.newGameState(ChessEngine.STARTING_FEN)
+        self.fen = self.gs.getFen() # taken while no search runs, the worker makes and undoes moves on self.gs
+        self.stopEvent = threading.Event()
+        self.worker = None
+
+    def send(self, line):
+        with self.outputLock:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+    def newGameState(self, fen):
+        if self.backend == "bitboard":
+            import ChessBitboard # builds its attack tables on import, so only loaded when selected
+            return ChessBitboard.BitboardGameState(fen)
+        return ChessEngine.GameState(fen)
+
+    """
+    Reads commands from source until quit or end of input
+    """
+    def run(self, source=sys.stdin):
+        lines = queue.Queue()
+        reader = threading.Thread(target=_readLines, args=(lines, source), daemon=True)
+        reader.start()
+        while True:
+            line = lines.get()
+            if line is None or not self.handle(line):
+                break
+        self.stopSearch()
+
+    """
+    Handles one command line, returns False on quit
+    """
+    def handle(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        command = tokens[0]
+        if command == "quit":
+            return False
+        elif command == "uci":
+            self.send("id name %s" % ENGINE_NAME)
+            self.send("id author %s" % ENGINE_AUTHOR)
+            self.send("option name Hash type spin default %d min 1 max 1024" % DEFAULT_HASH_MB)
+            self.send("option name Backend type combo default mailbox var mailbox var bitboard")
+            self.send("option name BookFile type string default <empty>")
+            self.send("option name TablebasePath type string default <empty>")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "stop":
+            self.stopSearch()
+        elif command == "ucinewgame":
+            self.stopSearch()
+            self.searcher = ChessSearch.Searcher(ChessEngine.TranspositionTable(self.hashMB, entryBytes=128), self.tablebase)
+        elif command == "setoption":
+            self.stopSearch()
+            self.setOption(tokens[1:])
+        elif command == "position":
+            self.stopSearch()
+            self.setPosition(tokens[1:])
+        elif command == "go":
+            self.stopSearch()
+            self.go(tokens[1:])
+        elif command == "d":
+            self.send(self.fen)
+        else:
+            self.send("info string unknown command %s" % command)
+        return True
+
+    def setOption(self, tokens):
+        if "name" not in tokens:
+            return
+        valueAt = tokens.index("value") if "value" in tokens else len(tokens)
+        name = " ".join(tokens[tokens.index("name") + 1:valueAt]).lower()
+        value = " ".join(tokens[valueAt + 1:])
+        if value == "<empty>":
+            value = ""
+        try:
+            if name == "hash":
+                self.hashMB = max(1, int(value))
+                self.searcher = ChessSearch.Searcher(ChessEngine.TranspositionTable(self.hashMB, entryBytes=128), self.tablebase)
+            elif name == "backend":
+                if value not in ("mailbox", "bitboard"):
+                    raise ValueError("unknown backend %s" % value)
+                self.backend = value
+                self.gs = self.newGameState(self.fen)
+            elif name == "bookfile":
+                if self.book is not None:
+                    self.book.close()
+                self.book = None
+                if value:
+                    import ChessBook
+                    self.book = ChessBook.OpeningBook(value)
+            elif name == "tablebasepath":
+                self.tablebase = None
+                if value:
+                    import ChessTablebase
+                    self.tablebase = ChessTablebase.Tablebase(value)
+                self.searcher.tablebase = self.tablebase
+            else:
+                self.send("info string unknown option %s" % name)
+        except (ValueError, OSError) as e:
+            self.send("info string %s" % e)
+
+    def setPosition(self, tokens):
+        movesAt = tokens.index("moves") if "moves" in tokens else len(tokens)
+        try:
+            if tokens and tokens[0] == "fen":
+                gs = self.newGameState(" ".join(tokens[1:movesAt]))
+            else:
+                gs = self.newGameState(ChessEngine.STARTING_FEN)
+            for notation in tokens[movesAt + 1:]:
+                gs.makeMove(ChessEngine.moveFromNotation(gs, notation))
+        except ValueError as e:
+            self.send("info string invalid position: %s" % e)
+            return
+        self.gs = gs
+        self.fen = gs.getFen()
+
+    def go(self, tokens):
+        options = {}
+        i = 0
+        while i < len(tokens):
+            if tokens[i] == "infinite":
+                options["infinite"] = True
+                i += 1
+            elif i + 1 < len(tokens):
+                options[tokens[i]] = tokens[i + 1]
+                i += 2
+            else:
+                i += 1
+        self.stopEvent = threading.Event()
+        try:
+            if "perft" in options:
+                target, args = self.runPerft, (int(options["perft"]),)
+            else:
+                target, args = self.runSearch, self.searchLimits(options)
+        except ValueError as e:
+            self.send("info string invalid go command: %s" % e)
+            return
+        self.worker = threading.Thread(target=target, args=args, daemon=True)
+        self.worker.start()
+
+    """
+    (maxDepth, timeLimit, nodeLimit, infinite) of a go command
+    """
+    def searchLimits(self, options):
+        maxDepth = int(options.get("depth", ChessSearch.MAX_PLY - 1))
+        nodeLimit = int(options["nodes"]) if "nodes" in options else None
+        timeLimit = None
+        if "movetime" in options:
+            timeLimit = int(options["movetime"]) / 1000.0
+        else:
+            remaining = options.get("wtime" if self.gs.whiteToMove else "btime")
+            if remaining is not None:
+                increment = int(options.get("winc" if self.gs.whiteToMove else "binc", 0)) / 1000.0
+                remaining = int(remaining) / 1000.0
+                movesToGo = int(options.get("movestogo", DEFAULT_MOVES_TO_GO))
+                timeLimit = min(remaining / max(movesToGo, 1) + increment * 0.8, remaining * 0.5)
+        if timeLimit is not None:
+            timeLimit = max(timeLimit - MOVE_OVERHEAD, 0.01)
+        return maxDepth, timeLimit, nodeLimit, options.get("infinite", False)
+
+    def stopSearch(self):
+        self.stopEvent.set()
+        if self.worker is not None:
+            self.worker.join()
+            self.worker = None
+
+    def runSearch(self, maxDepth, timeLimit, nodeLimit, infinite):
+        move = None
+        if self.book is not None:
+            move = self.book.chooseMove(self.gs)
+        if move is None:
+            result = self.searcher.search(self.gs, maxDepth, timeLimit, nodeLimit, self.stopEvent, self.sendInfo)
+            move = result.bestMove
+        if infinite: # the best move may only be sent once the GUI says stop
+            self.stopEvent.wait()
+        self.send("bestmove %s" % (move.getChessNotation() if move is not None else "0000"))
+
+    def sendInfo(self, result):
+        if abs(result.score) >= ChessSearch.MATE_THRESHOLD:
+            plies = ChessSearch.MATE_SCORE - abs(result.score)
+            score = "mate %d" % ((plies + 1) // 2 if result.score > 0 else -(plies // 2))
+        else:
+            score = "cp %d" % result.score
+        milliseconds = int(result.seconds * 1000)
+        nps = int(result.nodes / result.seconds) if result.seconds > 0 else 0
+        self.send("info depth %d score %s nodes %d nps %d time %d pv %s" % (result.depth, score, result.nodes, nps,
+                  milliseconds, " ".join(move.getChessNotation() for move in result.pv)))
+
+    """
+    Divide counts for every root move and the total, checking stop between root moves and at every inner node
+    """
+    def runPerft(self, depth):
+        start = time.perf_counter()
+        total = 0
+        for move in self.gs.getValidMoves():
+            if self.stopEvent.is_set():
+                break
+            self.gs.makeMove(move)
+            nodes = self.perft(depth - 1)
+            self.gs.undoMove()
+            if self.stopEvent.is_set():
+                break
+            self.send("%s: %d" % (move.getChessNotation(), nodes))
+            total += nodes
+        seconds = time.perf_counter() - start
+        self.send("")
+        self.send("Nodes searched: %d" % total)
+        self.send("info nodes %d time %d nps %d" % (total, int(seconds * 1000), int(total / seconds) if seconds > 0 else 0))
+
+    def perft(self, depth):
+        if depth <= 0:
+            return 1
+        moves = self.gs.getValidMoves()
+        if depth == 1 or self.stopEvent.is_set():
+            return len(moves)
+        nodes = 0
+        for move in moves:
+            self.gs.makeMove(move)
+            nodes += self.perft(depth - 1)
+            self.gs.undoMove()
+        return nodes
+
+
+def main():
+    UciEngine().run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())